@@ -0,0 +1,157 @@
+"""
+AgroVision In-Process Caches
+TTL + size-bounded LRU cache with hit/miss counters and optional JSON persistence
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Sentinel returned by TTLCache.get on a miss, so cached None values
+# (e.g. negative lookups) can be told apart from absent keys
+CACHE_MISS = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache where every entry expires after `ttl_seconds`.
+
+    When `persist_path` is set, entries are loaded from that JSON file on
+    start-up and changes mark the cache dirty; `flush()` writes it back
+    (atomically), so the cache survives restarts. flush() is blocking - the
+    app calls it periodically and on shutdown through run_blocking.
+    Persisted values must be JSON-serializable.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int,
+        ttl_seconds: float,
+        persist_path: Optional[str] = None,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        if persist_path:
+            self._load()
+
+    def get(self, key: str, default: Any = CACHE_MISS) -> Any:
+        """Return the cached value, or `default` if absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Store a value, evicting the least recently used entries beyond `max_entries`."""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._mark_dirty()
+
+    def expires_in(self, key: str) -> Optional[float]:
+        """Seconds until `key` expires (None if absent). Does not touch hit/miss counters."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            remaining = entry[0] - time.time()
+            return remaining if remaining > 0 else None
+
+    def delete(self, key: str):
+        """Drop a single entry."""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._mark_dirty()
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._mark_dirty()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for the /cache/stats endpoint."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "persistent": bool(self.persist_path),
+        }
+
+    def _load(self):
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Cache '{self.name}': ignoring unreadable {self.persist_path}: {e}")
+            return
+        now = time.time()
+        for key, (expires_at, value) in raw.items():
+            if expires_at >= now:
+                self._entries[key] = (expires_at, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        print(f"📂 Cache '{self.name}': restored {len(self._entries)} entries")
+
+    def flush(self) -> bool:
+        """Write the entries to `persist_path` if they changed since the last flush. Blocking."""
+        if not self.persist_path:
+            return False
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return False
+                snapshot = {k: list(v) for k, v in self._entries.items()}
+                self._dirty = False
+            tmp_path = f"{self.persist_path}.tmp"
+            try:
+                directory = os.path.dirname(self.persist_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, self.persist_path)
+            except (OSError, TypeError) as e:
+                print(f"⚠️ Cache '{self.name}': failed to persist: {e}")
+                with self._lock:
+                    self._dirty = True
+                return False
+            return True
+
+    def _mark_dirty(self):
+        # Caller holds the lock
+        if self.persist_path:
+            self._dirty = True
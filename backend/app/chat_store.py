@@ -0,0 +1,186 @@
+"""
+AgroVision Chat Message Store
+Append-only chat turns in the chat_messages table, with fallback to (and
+migration from) the legacy Consultation.chat_history JSONB array.
+All functions are blocking - call them through run_blocking.
+"""
+
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, exists, func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.database import ChatMessage, ChatSummary, Consultation
+
+APPEND_ATTEMPTS = 3
+
+
+def legacy_history(db: Session, session_id: uuid.UUID) -> List[Dict[str, str]]:
+    """
+    The consultation's chat_history column only (no other JSONB columns
+    loaded), with every entry coerced to string role/content - legacy rows
+    may hold nulls or bare values the NOT NULL chat_messages columns reject.
+    """
+    history = db.query(Consultation.chat_history).filter(Consultation.session_id == session_id).scalar()
+    messages = []
+    for message in history or []:
+        if not isinstance(message, dict):
+            message = {"content": message}
+        messages.append({
+            "role": "assistant" if message.get("role") == "assistant" else "user",
+            "content": "" if message.get("content") is None else str(message["content"]),
+        })
+    return messages
+
+
+def _stage_legacy_history(db: Session, session_id: uuid.UUID) -> int:
+    # Adds the legacy messages as seq 1..n without committing; returns n
+    history = legacy_history(db, session_id)
+    db.add_all([
+        ChatMessage(
+            session_id=session_id,
+            seq=seq,
+            role=message["role"],
+            content=message["content"],
+            created_at=datetime.utcnow(),
+        )
+        for seq, message in enumerate(history, start=1)
+    ])
+    return len(history)
+
+
+def append_messages(db: Session, session_id: uuid.UUID, messages: List[Tuple[str, str]]) -> int:
+    """
+    Insert (role, content) messages after the session's last seq and commit.
+    A session still on the legacy array is migrated in the same transaction.
+    Retries if a concurrent append took the same seq. Returns the new last seq.
+    """
+    for attempt in range(APPEND_ATTEMPTS):
+        last_seq = db.query(func.max(ChatMessage.seq)).filter(ChatMessage.session_id == session_id).scalar()
+        if last_seq is None:
+            last_seq = _stage_legacy_history(db, session_id)
+        db.add_all([
+            ChatMessage(session_id=session_id, seq=last_seq + offset, role=role, content=content,
+                        created_at=datetime.utcnow())
+            for offset, (role, content) in enumerate(messages, start=1)
+        ])
+        try:
+            db.commit()
+            return last_seq + len(messages)
+        except IntegrityError:
+            db.rollback()
+            if attempt == APPEND_ATTEMPTS - 1:
+                raise
+    return 0
+
+
+def recent_messages(db: Session, session_id: uuid.UUID, limit: int) -> List[Dict[str, str]]:
+    """Last `limit` messages in chronological order, read from the tail of the index."""
+    rows = (
+        db.query(ChatMessage.role, ChatMessage.content)
+        .filter(ChatMessage.session_id == session_id)
+        .order_by(ChatMessage.seq.desc())
+        .limit(limit)
+        .all()
+    )
+    if rows:
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+    return legacy_history(db, session_id)[-limit:] if limit > 0 else []
+
+
+def get_summary(db: Session, session_id: uuid.UUID) -> Optional[Dict[str, Any]]:
+    row = db.get(ChatSummary, session_id)
+    if row is None:
+        return None
+    return {"summary": row.summary, "through_seq": row.through_seq, "updated_at": row.updated_at}
+
+
+def save_summary(db: Session, session_id: uuid.UUID, summary: str, through_seq: int):
+    """Upsert the session's rolling summary; never moves `through_seq` backwards."""
+    row = db.get(ChatSummary, session_id)
+    if row is None:
+        db.add(ChatSummary(session_id=session_id, summary=summary, through_seq=through_seq,
+                           updated_at=datetime.utcnow()))
+    elif through_seq > row.through_seq:
+        row.summary = summary
+        row.through_seq = through_seq
+        row.updated_at = datetime.utcnow()
+    db.commit()
+
+
+def messages_between(
+    db: Session, session_id: uuid.UUID, after_seq: int, through_seq: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Messages with after_seq < seq <= through_seq (no upper bound when None), in order."""
+    query = (
+        db.query(ChatMessage.seq, ChatMessage.role, ChatMessage.content)
+        .filter(ChatMessage.session_id == session_id, ChatMessage.seq > after_seq)
+    )
+    if through_seq is not None:
+        query = query.filter(ChatMessage.seq <= through_seq)
+    rows = query.order_by(ChatMessage.seq).all()
+    return [{"seq": seq, "role": role, "content": content} for seq, role, content in rows]
+
+
+def prompt_history(db: Session, session_id: uuid.UUID, limit: int) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """
+    What a chat prompt needs: (rolling summary text or None, recent messages).
+    With a summary the tail is every message after its `through_seq` (at
+    least the last `limit`), so no turn falls between summary and tail.
+    """
+    summary = get_summary(db, session_id)
+    if summary is None:
+        return None, recent_messages(db, session_id, limit)
+    tail = messages_between(db, session_id, summary["through_seq"])
+    if len(tail) < limit:
+        return summary["summary"], recent_messages(db, session_id, limit)
+    return summary["summary"], [{"role": m["role"], "content": m["content"]} for m in tail]
+
+
+def migrate_legacy_histories(db: Session, batch_size: int = 200) -> int:
+    """
+    Copy every non-empty legacy chat_history that has no chat_messages rows
+    yet into the table, one batch per commit. The legacy column is left as is.
+    If a batch fails, its sessions are retried one by one and a session that
+    still fails is skipped (it keeps being read from the legacy column).
+    Returns the number of consultations migrated.
+    """
+    migrated = 0
+    skipped = set()
+    while True:
+        query = (
+            db.query(Consultation.session_id)
+            .filter(case(
+                (func.jsonb_typeof(Consultation.chat_history) == "array",
+                 func.jsonb_array_length(Consultation.chat_history)),
+                else_=0,
+            ) > 0)
+            .filter(~exists().where(ChatMessage.session_id == Consultation.session_id))
+        )
+        if skipped:
+            query = query.filter(Consultation.session_id.notin_(skipped))
+        session_ids = [row[0] for row in query.limit(batch_size).all()]
+        if not session_ids:
+            return migrated
+        for session_id in session_ids:
+            _stage_legacy_history(db, session_id)
+        try:
+            db.commit()
+            migrated += len(session_ids)
+            continue
+        except SQLAlchemyError:
+            db.rollback()
+        # One bad history (or a chat turn migrating a session concurrently) must
+        # not fail the whole batch forever
+        for session_id in session_ids:
+            _stage_legacy_history(db, session_id)
+            try:
+                db.commit()
+                migrated += 1
+            except SQLAlchemyError as e:
+                db.rollback()
+                skipped.add(session_id)
+                print(f"⚠️ Chat history migration skipped {session_id}: {e.__class__.__name__}")
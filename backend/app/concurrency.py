@@ -0,0 +1,83 @@
+"""
+AgroVision Concurrency Helpers
+Bounded executor for blocking SDK calls (GCS, SQLAlchemy) made from async endpoints,
+and single-flight coalescing of concurrent identical work
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Upper bound on blocking calls in flight at once. Keeps a burst of
+# consultations from spawning unbounded threads or exhausting the DB pool.
+BLOCKING_IO_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", "32"))
+
+blocking_executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_IO_WORKERS,
+    thread_name_prefix="agrovision-io",
+)
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a blocking function on the bounded executor without stalling the event loop.
+    Use for SDKs that have no async client (google-cloud-storage, sync SQLAlchemy).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor():
+    """Release executor threads on application shutdown."""
+    blocking_executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller (the
+    leader) runs the coroutine, callers arriving while it is in flight await
+    the leader's result instead of starting their own. Keys are forgotten as
+    soon as the call finishes, so only overlapping work is de-duplicated.
+    
+    In-process only - state lives on the event loop of this worker.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.leaders = 0
+        self.followers = 0
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def run(self, key: str, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Result of `func()` for `key`, and whether it was shared from another
+        caller's in-flight call. The call is shielded, so a cancelled leader
+        does not take its followers down with it.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.followers += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(func())
+        self._calls[key] = task
+        self.leaders += 1
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task), False
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an unawaited failure isn't logged as lost
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
@@ -7,17 +7,33 @@ import os
 import uuid
 from datetime import datetime
 
-from sqlalchemy import create_engine, Column, DateTime, Text, ARRAY, String
+from sqlalchemy import create_engine, Column, DateTime, Text, ARRAY, String, Integer, BigInteger, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+from app.concurrency import BLOCKING_IO_WORKERS
+
 # Database Configuration - Use DATABASE_URL from environment
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
+# Connection pool sizing - must cover the blocking I/O executor so concurrent
+# consultations don't queue on pool checkout. Overflow defaults to whatever
+# the pool alone leaves uncovered (at least 20).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(max(20, BLOCKING_IO_WORKERS - DB_POOL_SIZE))))
+if DB_POOL_SIZE + DB_MAX_OVERFLOW < BLOCKING_IO_WORKERS:
+    print(f"⚠️ DB pool ({DB_POOL_SIZE} + {DB_MAX_OVERFLOW} overflow) is smaller than "
+          f"BLOCKING_IO_WORKERS={BLOCKING_IO_WORKERS}; blocking calls will queue on pool checkout")
+
 # Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = create_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+)
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -109,7 +125,8 @@ class Consultation(Base):
         nullable=True
     )
     
-    # Chat History - Stores conversation history for stateful chat
+    # Legacy Chat History - superseded by the chat_messages table; kept readable
+    # for consultations whose history has not been migrated yet
     # Example: [{"role": "user", "content": "Why scab?"}, {"role": "assistant", "content": "Because..."}]
     chat_history = Column(
         JSONB,
@@ -121,6 +138,168 @@ class Consultation(Base):
         return f"<Consultation(session_id={self.session_id}, created_at={self.created_at})>"
 
 
+class ChatMessage(Base):
+    """
+    ChatMessage Model - One chat turn entry, appended (never rewritten) per message.
+    
+    `seq` numbers a consultation's messages from 1; (session_id, seq) is
+    unique, so concurrent appends cannot interleave silently.
+    """
+    __tablename__ = "chat_messages"
+    __table_args__ = (
+        Index("ix_chat_messages_session_seq", "session_id", "seq", unique=True),
+    )
+
+    id = Column(
+        BigInteger,
+        primary_key=True,
+        autoincrement=True
+    )
+    
+    session_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("consultations.session_id", ondelete="CASCADE"),
+        nullable=False
+    )
+    
+    seq = Column(
+        Integer,
+        nullable=False
+    )
+    
+    # "user" or "assistant"
+    role = Column(
+        String(16),
+        nullable=False
+    )
+    
+    content = Column(
+        Text,
+        nullable=False
+    )
+    
+    created_at = Column(
+        DateTime,
+        default=datetime.utcnow,
+        nullable=False
+    )
+
+    def __repr__(self):
+        return f"<ChatMessage(session_id={self.session_id}, seq={self.seq}, role={self.role})>"
+
+
+class ChatSummary(Base):
+    """
+    ChatSummary Model - Rolling summary of a consultation's older chat turns.
+    
+    Covers chat_messages up to and including `through_seq`; chat prompts use
+    it plus the recent tail instead of the full history.
+    """
+    __tablename__ = "chat_summaries"
+
+    session_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("consultations.session_id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    
+    summary = Column(
+        Text,
+        nullable=False
+    )
+    
+    through_seq = Column(
+        Integer,
+        nullable=False
+    )
+    
+    updated_at = Column(
+        DateTime,
+        default=datetime.utcnow,
+        nullable=False
+    )
+
+    def __repr__(self):
+        return f"<ChatSummary(session_id={self.session_id}, through_seq={self.through_seq})>"
+
+
+class AnalysisJob(Base):
+    """
+    AnalysisJob Model - Durable queue entry for an asynchronous /analyze request.
+    
+    Workers claim `queued` rows with SELECT ... FOR UPDATE SKIP LOCKED, so a
+    job is never run twice concurrently. The consultation it produces is
+    stored under the pre-allocated `session_id`.
+    """
+    __tablename__ = "analysis_jobs"
+
+    job_id = Column(
+        UUID(as_uuid=True),
+        primary_key=True,
+        default=uuid.uuid4
+    )
+    
+    # Session the resulting Consultation will be saved under
+    session_id = Column(
+        UUID(as_uuid=True),
+        nullable=False,
+        index=True
+    )
+    
+    # queued -> running -> succeeded | rejected (4xx outcome) | failed
+    status = Column(
+        String(16),
+        nullable=False,
+        default="queued",
+        index=True
+    )
+    
+    # Optional client Idempotency-Key - a repeat returns the existing job
+    idempotency_key = Column(
+        String(255),
+        unique=True,
+        nullable=True
+    )
+    
+    # Form fields of the original request
+    # Example: {"lat": 18.15, "lon": 74.58, "farmer_name": "Rajesh Kumar", "crop_name": "Apple", ...}
+    request = Column(
+        JSONB,
+        nullable=False
+    )
+    
+    # Uploaded images: [{"filename": "leaf.jpg", "content_type": "image/jpeg", "data": "<base64>"}]
+    # Cleared once the job finishes
+    files = Column(
+        JSONB,
+        nullable=True
+    )
+    
+    attempts = Column(
+        Integer,
+        default=0,
+        nullable=False
+    )
+    
+    # Rejection detail or error message of the last attempt
+    error = Column(
+        JSONB,
+        nullable=True
+    )
+    
+    created_at = Column(
+        DateTime,
+        default=datetime.utcnow,
+        nullable=False,
+        index=True
+    )
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<AnalysisJob(job_id={self.job_id}, status={self.status})>"
+
+
 # Dependency for FastAPI - Database Session
 def get_db():
     """
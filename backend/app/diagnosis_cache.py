@@ -0,0 +1,99 @@
+"""
+AgroVision Diagnosis Cache
+Reuses Agent 1 results for duplicate and near-duplicate image submissions
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class DiagnosisCache:
+    """
+    Recent Agent 1 results keyed by crop + the perceptual hashes of the images.
+
+    A submission matches an entry when it has the same crop and number of
+    images and every image hash pairs up with a distinct cached hash within
+    `max_distance` bits. Entries expire after `ttl_seconds`; the oldest are
+    evicted beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, max_distance: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _match_distance(self, hashes: List[int], cached: List[int]) -> Optional[int]:
+        """Worst per-image distance of a greedy one-to-one pairing, or None if no pairing fits."""
+        if len(hashes) != len(cached):
+            return None
+        remaining = list(cached)
+        worst = 0
+        for h in hashes:
+            best_idx, best_dist = None, None
+            for idx, c in enumerate(remaining):
+                dist = hamming_distance(h, c)
+                if dist <= self.max_distance and (best_dist is None or dist < best_dist):
+                    best_idx, best_dist = idx, dist
+            if best_idx is None:
+                return None
+            remaining.pop(best_idx)
+            worst = max(worst, best_dist)
+        return worst
+
+    def lookup(self, crop_name: str, hashes: List[int]) -> Optional[Dict[str, Any]]:
+        """Closest live entry for this crop + image set, with its `distance`, or None."""
+        now = time.time()
+        best = None
+        with self._lock:
+            for key in list(self._entries.keys()):
+                entry = self._entries[key]
+                if entry["expires_at"] < now:
+                    del self._entries[key]
+                    continue
+                if entry["crop_name"] != crop_name:
+                    continue
+                distance = self._match_distance(hashes, entry["hashes"])
+                if distance is not None and (best is None or distance < best["distance"]):
+                    best = dict(entry, distance=distance)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best["session_id"])
+            return best
+
+    def store(self, crop_name: str, hashes: List[int], session_id: str, agent1_result: Dict[str, Any]):
+        """Remember a fresh Agent 1 result for this submission."""
+        with self._lock:
+            self._entries[session_id] = {
+                "crop_name": crop_name,
+                "hashes": list(hashes),
+                "session_id": session_id,
+                "agent1_result": agent1_result,
+                "created_at": time.time(),
+                "expires_at": time.time() + self.ttl_seconds,
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "max_hamming_distance": self.max_distance,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
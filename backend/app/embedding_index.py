@@ -0,0 +1,129 @@
+"""
+AgroVision Local Embedding Index
+CPU-only colour/texture features with cosine kNN against golden references
+"""
+
+import io
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+FEATURE_EDGE = 128
+HUE_BINS, SATURATION_BINS, VALUE_BINS = 16, 4, 2
+GRADIENT_BINS = 16
+ORIENTATION_BINS = 8
+
+
+def image_features(data: bytes) -> Optional[np.ndarray]:
+    """
+    Fixed-length descriptor for a leaf image: an HSV colour histogram plus
+    gradient-magnitude and orientation histograms for texture. Histograms are
+    square-rooted (Hellinger) and the vector is L2-normalized, so a dot
+    product is the cosine similarity. None if the image cannot be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert("RGB").resize((FEATURE_EDGE, FEATURE_EDGE), Image.Resampling.BILINEAR)
+            hsv = np.asarray(img.convert("HSV"), dtype=np.float32) / 255.0
+            gray = np.asarray(img.convert("L"), dtype=np.float32) / 255.0
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+    colour, _ = np.histogramdd(
+        hsv.reshape(-1, 3),
+        bins=(HUE_BINS, SATURATION_BINS, VALUE_BINS),
+        range=((0, 1), (0, 1), (0, 1)),
+    )
+    colour = colour.ravel() / colour.sum()
+
+    gy, gx = np.gradient(gray)
+    magnitude = np.hypot(gx, gy)
+    magnitude_hist, _ = np.histogram(magnitude, bins=GRADIENT_BINS, range=(0, 0.5))
+    magnitude_hist = magnitude_hist / max(magnitude_hist.sum(), 1)
+    orientation = np.mod(np.arctan2(gy, gx), np.pi)
+    orientation_hist, _ = np.histogram(
+        orientation, bins=ORIENTATION_BINS, range=(0, np.pi), weights=magnitude
+    )
+    orientation_hist = orientation_hist / max(orientation_hist.sum(), 1e-6)
+
+    vector = np.sqrt(np.concatenate([colour, 0.5 * magnitude_hist, 0.5 * orientation_hist]))
+    norm = np.linalg.norm(vector)
+    return (vector / norm).astype(np.float32) if norm else None
+
+
+class EmbeddingIndex:
+    """
+    Labelled feature vectors with vectorized cosine kNN.
+
+    Reference vectors (one per golden reference image) are permanent; vectors
+    learned from high-confidence consultations are kept in a bounded FIFO.
+    """
+
+    def __init__(self, max_learned: int = 2000):
+        self.max_learned = max_learned
+        self.queries = 0
+        self.built_at: Optional[float] = None
+        self._references: Dict[str, np.ndarray] = {}
+        self._learned: deque = deque(maxlen=max_learned)
+        self._labels: List[str] = []
+        self._label_ids = np.zeros(0, dtype=np.int32)
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def _rebuild(self):
+        # Caller holds the lock
+        labels = list(self._references.keys()) + [label for label, _ in self._learned]
+        vectors = list(self._references.values()) + [vector for _, vector in self._learned]
+        self._labels = sorted(set(labels))
+        self._label_ids = np.array([self._labels.index(label) for label in labels], dtype=np.int32)
+        self._matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def set_references(self, vectors: Dict[str, np.ndarray]):
+        """Replace the golden reference vectors (disease name -> vector)."""
+        with self._lock:
+            self._references = dict(vectors)
+            self._rebuild()
+            self.built_at = time.time()
+
+    def learn(self, label: str, vectors: List[np.ndarray]):
+        """Add vectors from a confirmed consultation."""
+        with self._lock:
+            for vector in vectors:
+                self._learned.append((label, vector))
+            self._rebuild()
+
+    def query(self, vectors: List[np.ndarray], candidates: Optional[List[str]] = None, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Top-k diseases for a set of images. Each image is scored against every
+        stored vector; a disease's score is its best match per image averaged
+        over the images. Restricted to `candidates` when given.
+        """
+        with self._lock:
+            labels, label_ids, matrix = self._labels, self._label_ids, self._matrix
+        self.queries += 1
+        if not labels or not vectors:
+            return []
+
+        similarities = np.vstack(vectors) @ matrix.T  # (images, stored vectors)
+        scores: Dict[str, float] = {}
+        allowed = set(candidates) if candidates is not None else None
+        for label_id, label in enumerate(labels):
+            if allowed is not None and label not in allowed:
+                continue
+            scores[label] = float(similarities[:, label_ids == label_id].max(axis=1).mean())
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [{"disease": label, "similarity": round(score, 4)} for label, score in ranked]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "reference_vectors": len(self._references),
+            "learned_vectors": len(self._learned),
+            "max_learned": self.max_learned,
+            "queries": self.queries,
+            "built_at": self.built_at,
+        }
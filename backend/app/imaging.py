@@ -0,0 +1,358 @@
+"""
+AgroVision Image Preprocessing
+Normalizes raw phone photos before storage and inference, and crops the
+model's copy down to the leaf region
+"""
+
+import base64
+import io
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Output formats supported by the normalizer: Pillow format -> (extension, MIME type)
+OUTPUT_FORMATS = {
+    "JPEG": ("jpg", "image/jpeg"),
+    "WEBP": ("webp", "image/webp"),
+}
+
+
+class UndecodableImageError(ValueError):
+    """An upload Pillow cannot decode, so it cannot be re-encoded without its metadata."""
+
+
+@dataclass
+class PreparedImage:
+    """An uploaded image after preprocessing, ready for upload and inference."""
+    filename: str
+    content_type: str
+    extension: str
+    data: bytes
+    original_data: bytes
+    original_content_type: Optional[str]
+    stats: Dict[str, Any] = field(default_factory=dict)
+    # Copy sent to the vision model (leaf region crop); falls back to `data`
+    model_data: Optional[bytes] = None
+    model_content_type: Optional[str] = None
+
+    def model_data_url(self) -> str:
+        """Inline data URL of the model copy, for OpenAI image_url inputs."""
+        data = self.model_data if self.model_data is not None else self.data
+        content_type = self.model_content_type or self.content_type
+        return f"data:{content_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+def normalize_image(
+    filename: str,
+    data: bytes,
+    content_type: Optional[str],
+    max_edge: int,
+    output_format: str = "JPEG",
+    quality: int = 85,
+) -> PreparedImage:
+    """
+    Apply EXIF orientation, downscale so the longest edge is at most `max_edge`,
+    re-encode as `output_format` at `quality` and drop all metadata.
+
+    Raises UndecodableImageError for images Pillow cannot decode (e.g. HEIC):
+    their raw bytes still carry metadata, so they must never be stored or sent
+    on. An `output_format` outside OUTPUT_FORMATS is a ValueError.
+    """
+    started = time.perf_counter()
+    output_format = output_format.upper()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format {output_format!r}; use one of {sorted(OUTPUT_FORMATS)}")
+    extension, out_content_type = OUTPUT_FORMATS[output_format]
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            original_size = img.size
+            img = ImageOps.exif_transpose(img)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            normalized_size = img.size
+
+            out = io.BytesIO()
+            # No exif/icc arguments: metadata (GPS, device, ...) is stripped
+            img.save(out, format=output_format, quality=quality, optimize=True)
+            normalized = out.getvalue()
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        raise UndecodableImageError(f"{filename}: cannot decode image ({e})") from e
+
+    # Always keep the re-encoded bytes, even when they are not smaller than the
+    # upload: the raw bytes still carry EXIF (GPS, device) and must not be stored
+
+    original_pixels = original_size[0] * original_size[1]
+    normalized_pixels = normalized_size[0] * normalized_size[1]
+    return PreparedImage(
+        filename=filename,
+        content_type=out_content_type,
+        extension=extension,
+        data=normalized,
+        original_data=data,
+        original_content_type=content_type,
+        stats={
+            "filename": filename,
+            "normalized": True,
+            "original_dimensions": list(original_size),
+            "normalized_dimensions": list(normalized_size),
+            "original_bytes": len(data),
+            "normalized_bytes": len(normalized),
+            "bytes_saved": len(data) - len(normalized),
+            "original_pixels": original_pixels,
+            "normalized_pixels": normalized_pixels,
+            "pixels_saved": original_pixels - normalized_pixels,
+            "seconds": round(time.perf_counter() - started, 4),
+        },
+    )
+
+
+def summarize_preprocessing(images: List[PreparedImage], wall_seconds: float) -> Dict[str, Any]:
+    """Per-request preprocessing report for ai_diagnosis_log."""
+    return {
+        "images": [img.stats for img in images],
+        "total_original_bytes": sum(img.stats["original_bytes"] for img in images),
+        "total_normalized_bytes": sum(img.stats["normalized_bytes"] for img in images),
+        "total_bytes_saved": sum(img.stats["bytes_saved"] for img in images),
+        "total_pixels_saved": sum(img.stats["pixels_saved"] for img in images),
+        "roi_crops_applied": sum(1 for img in images if img.stats.get("roi", {}).get("applied")),
+        "high_detail_tiles_before": sum(img.stats.get("roi", {}).get("tiles_before", 0) for img in images),
+        "high_detail_tiles_after": sum(img.stats.get("roi", {}).get("tiles_after", 0) for img in images),
+        "seconds": round(wall_seconds, 4),
+    }
+
+
+# =============================================================================
+# LEAF REGION-OF-INTEREST CROPPING
+# =============================================================================
+
+def estimate_high_detail_tiles(width: int, height: int) -> int:
+    """
+    512px tiles billed for an image at detail="high": fit within 2048x2048,
+    then scale the shortest side down to 768, then count tiles.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def leaf_mask(rgb: np.ndarray) -> np.ndarray:
+    """
+    Boolean mask of leaf-like pixels: green foliage (excess-green index) plus
+    the yellow/brown lesion tones that sit on it. Sky, soil greys and skin are
+    mostly excluded by requiring a clear chromatic signal.
+    """
+    rgb = rgb.astype(np.float32)
+    total = rgb.sum(axis=2) + 1e-6
+    r, g, b = rgb[..., 0] / total, rgb[..., 1] / total, rgb[..., 2] / total
+    brightness = total / 3.0
+
+    saturation = (rgb.max(axis=2) - rgb.min(axis=2)) / (rgb.max(axis=2) + 1e-6)
+
+    excess_green = 2 * g - r - b
+    green = (excess_green > 0.06) & (brightness > 25)
+    # Chlorotic / necrotic tissue: strongly saturated warm hue with low blue.
+    # The saturation floor keeps dull soil browns out of the mask.
+    lesion = (g > b + 0.06) & (r > b + 0.08) & (saturation > 0.6) & (brightness > 50) & (brightness < 235)
+    return green | lesion
+
+
+def find_leaf_box(
+    rgb: np.ndarray,
+    min_foreground: float,
+    max_area_fraction: float,
+    min_fill: float,
+    margin: float,
+) -> Dict[str, Any]:
+    """
+    Bounding box (fractions of width/height) around the leaf mask, or a
+    reason why the crop should not be trusted.
+    """
+    mask = leaf_mask(rgb)
+    foreground = float(mask.mean())
+    if foreground < min_foreground:
+        return {"box": None, "reason": "too_little_foreground", "foreground": foreground}
+
+    ys, xs = np.nonzero(mask)
+    # Percentiles instead of min/max so stray green specks don't stretch the box
+    y0, y1 = np.percentile(ys, [1, 99])
+    x0, x1 = np.percentile(xs, [1, 99])
+    height, width = mask.shape
+    box = [
+        max(0.0, x0 / width - margin),
+        max(0.0, y0 / height - margin),
+        min(1.0, (x1 + 1) / width + margin),
+        min(1.0, (y1 + 1) / height + margin),
+    ]
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    if area > max_area_fraction:
+        return {"box": None, "reason": "leaf_fills_frame", "foreground": foreground, "area": area}
+
+    bx0, by0 = int(box[0] * width), int(box[1] * height)
+    bx1, by1 = max(bx0 + 1, int(box[2] * width)), max(by0 + 1, int(box[3] * height))
+    fill = float(mask[by0:by1, bx0:bx1].mean())
+    if fill < min_fill:
+        return {"box": None, "reason": "scattered_foreground", "foreground": foreground, "fill": fill}
+
+    return {"box": box, "reason": "cropped", "foreground": foreground, "area": area, "fill": fill}
+
+
+def crop_to_leaf_region(
+    image: PreparedImage,
+    analysis_edge: int = 256,
+    min_foreground: float = 0.02,
+    max_area_fraction: float = 0.85,
+    min_fill: float = 0.25,
+    margin: float = 0.06,
+    quality: int = 85,
+) -> PreparedImage:
+    """
+    Set `image.model_data` to a crop around the leaf/lesion region so fewer
+    high-detail tiles are billed. Segmentation runs on a small thumbnail; when
+    it is unsure the model gets the full image. Stats land in image.stats["roi"].
+    """
+    started = time.perf_counter()
+    try:
+        with Image.open(io.BytesIO(image.data)) as img:
+            img = img.convert("RGB")
+            full_width, full_height = img.size
+            thumb = img.copy()
+            thumb.thumbnail((analysis_edge, analysis_edge))
+            result = find_leaf_box(np.asarray(thumb), min_foreground, max_area_fraction, min_fill, margin)
+
+            tiles_before = estimate_high_detail_tiles(full_width, full_height)
+            roi = {
+                "applied": False,
+                "reason": result["reason"],
+                "foreground_fraction": round(result["foreground"], 4),
+                "tiles_before": tiles_before,
+                "tiles_after": tiles_before,
+            }
+            if result["box"] is not None:
+                x0, y0, x1, y1 = result["box"]
+                crop_box = (
+                    int(x0 * full_width), int(y0 * full_height),
+                    int(math.ceil(x1 * full_width)), int(math.ceil(y1 * full_height)),
+                )
+                cropped = img.crop(crop_box)
+                tiles_after = estimate_high_detail_tiles(*cropped.size)
+                if tiles_after < tiles_before:
+                    out = io.BytesIO()
+                    cropped.save(out, format="JPEG", quality=quality, optimize=True)
+                    image.model_data = out.getvalue()
+                    image.model_content_type = "image/jpeg"
+                    roi.update({
+                        "applied": True,
+                        "box": list(crop_box),
+                        "cropped_dimensions": list(cropped.size),
+                        "tiles_after": tiles_after,
+                    })
+                else:
+                    roi["reason"] = "no_tile_savings"
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        roi = {"applied": False, "reason": f"decode_error: {e}"}
+
+    roi["seconds"] = round(time.perf_counter() - started, 4)
+    image.stats["roi"] = roi
+    return image
+
+
+# =============================================================================
+# IMAGE QUALITY GATE
+# =============================================================================
+
+def laplacian_variance(gray: np.ndarray) -> float:
+    """Variance of the 4-neighbour Laplacian - low values mean a blurry image."""
+    gray = gray.astype(np.float32)
+    lap = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+        - 4 * gray[1:-1, 1:-1]
+    )
+    return float(lap.var())
+
+
+def assess_image_quality(
+    image: PreparedImage,
+    min_side: int = 224,
+    min_sharpness: float = 8.0,
+    min_brightness: float = 30.0,
+    max_brightness: float = 225.0,
+    max_clipped_fraction: float = 0.6,
+    analysis_edge: int = 512,
+) -> Dict[str, Any]:
+    """
+    Millisecond checks for photos no model can diagnose: too small, blurry,
+    too dark or blown out. Scores are computed on a grayscale thumbnail and
+    stored in image.stats["quality"]; `passed` is False with `reasons` when
+    the image is hopeless. Undecodable images pass (the model decides).
+    """
+    started = time.perf_counter()
+    try:
+        with Image.open(io.BytesIO(image.data)) as img:
+            gray_img = img.convert("L")
+            width, height = image.stats.get("original_dimensions") or gray_img.size
+            gray_img.thumbnail((analysis_edge, analysis_edge))
+            gray = np.asarray(gray_img)
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        quality = {"passed": True, "reasons": [], "skipped": f"decode_error: {e}"}
+        image.stats["quality"] = quality
+        return quality
+
+    histogram = np.bincount(gray.ravel(), minlength=256) / gray.size
+    quality = {
+        "width": int(width),
+        "height": int(height),
+        "sharpness": round(laplacian_variance(gray), 2),
+        "mean_brightness": round(float(gray.mean()), 2),
+        "dark_fraction": round(float(histogram[:16].sum()), 4),
+        "bright_fraction": round(float(histogram[240:].sum()), 4),
+    }
+
+    reasons = []
+    if min(width, height) < min_side:
+        reasons.append("resolution_too_low")
+    if quality["sharpness"] < min_sharpness:
+        reasons.append("too_blurry")
+    if quality["mean_brightness"] < min_brightness or quality["dark_fraction"] > max_clipped_fraction:
+        reasons.append("too_dark")
+    if quality["mean_brightness"] > max_brightness or quality["bright_fraction"] > max_clipped_fraction:
+        reasons.append("overexposed")
+
+    quality.update({
+        "passed": not reasons,
+        "reasons": reasons,
+        "seconds": round(time.perf_counter() - started, 4),
+    })
+    image.stats["quality"] = quality
+    return quality
+
+
+# =============================================================================
+# PERCEPTUAL HASHING
+# =============================================================================
+
+def dhash(image: PreparedImage, hash_size: int = 8) -> Optional[int]:
+    """
+    Difference hash of the (normalized) image: 64 bits for hash_size=8.
+    Re-encodes, resizes and small crops barely move it, so Hamming distance
+    between hashes measures visual near-duplication. None if undecodable.
+    """
+    try:
+        with Image.open(io.BytesIO(image.data)) as img:
+            small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    image.stats["dhash"] = f"{value:0{hash_size * hash_size // 4}x}"
+    return value
@@ -0,0 +1,211 @@
+"""
+AgroVision Analysis Job Queue
+Postgres-backed durable queue for asynchronous /analyze requests.
+All functions are blocking - call them through run_blocking.
+"""
+
+import base64
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.database import AnalysisJob
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_REJECTED = "rejected"
+JOB_FAILED = "failed"
+JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_REJECTED, JOB_FAILED)
+
+
+class IdempotencyKeyConflict(Exception):
+    """The idempotency key already names a job for a different request."""
+
+
+def job_status(job: AnalysisJob) -> Dict[str, Any]:
+    """Public view of a job (no image payload)."""
+    return {
+        "job_id": str(job.job_id),
+        "session_id": str(job.session_id),
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def enqueue_job(
+    db: Session,
+    request: Dict[str, Any],
+    raw_files: List[Tuple[str, bytes, Optional[str]]],
+    idempotency_key: Optional[str] = None,
+    fingerprint: Optional[str] = None,
+    idempotency_ttl_seconds: Optional[float] = None,
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    Insert a queued job. Returns (status, created); with an idempotency key
+    that already has a job, that job's status is returned and created is False.
+    `fingerprint` is required with a key; raises IdempotencyKeyConflict if the
+    key's job was for a different fingerprint.
+    A key older than `idempotency_ttl_seconds` is released from its old job
+    and reused for the new one.
+    """
+    if idempotency_key:
+        if not fingerprint:
+            raise ValueError("an idempotency key needs a request fingerprint")
+        existing = db.query(AnalysisJob).filter(AnalysisJob.idempotency_key == idempotency_key).first()
+        if existing and idempotency_ttl_seconds is not None and (
+            existing.created_at < datetime.utcnow() - timedelta(seconds=idempotency_ttl_seconds)
+        ):
+            # Released in the same transaction as the insert below
+            existing.idempotency_key = None
+            db.flush()
+            existing = None
+        if existing:
+            return _existing_job(existing, fingerprint), False
+
+    job = AnalysisJob(
+        job_id=uuid.uuid4(),
+        session_id=uuid.uuid4(),
+        status=JOB_QUEUED,
+        idempotency_key=idempotency_key,
+        # The fingerprint rides along with the form fields; workers ignore it
+        request={**request, "fingerprint": fingerprint} if idempotency_key else request,
+        files=[
+            {"filename": name, "content_type": content_type, "data": base64.b64encode(data).decode("utf-8")}
+            for name, data, content_type in raw_files
+        ],
+        attempts=0,
+        created_at=datetime.utcnow(),
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Lost a race on the same idempotency key
+        db.rollback()
+        existing = db.query(AnalysisJob).filter(AnalysisJob.idempotency_key == idempotency_key).first()
+        return _existing_job(existing, fingerprint), False
+    db.refresh(job)
+    return job_status(job), True
+
+
+def _existing_job(job: AnalysisJob, fingerprint: str) -> Dict[str, Any]:
+    if job.request.get("fingerprint") != fingerprint:
+        raise IdempotencyKeyConflict(job.idempotency_key)
+    return job_status(job)
+
+
+def claim_next_job(db: Session) -> Optional[Dict[str, Any]]:
+    """
+    Oldest queued job, marked running. Rows locked by another worker are
+    skipped. Returns the request fields and decoded files, or None when the
+    queue is empty.
+    """
+    job = (
+        db.query(AnalysisJob)
+        .filter(AnalysisJob.status == JOB_QUEUED)
+        .order_by(AnalysisJob.created_at)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if job is None:
+        db.rollback()
+        return None
+
+    job.status = JOB_RUNNING
+    job.started_at = datetime.utcnow()
+    job.attempts += 1
+    claimed = {
+        "job_id": job.job_id,
+        "session_id": str(job.session_id),
+        "attempts": job.attempts,
+        "request": dict(job.request),
+        "raw_files": [
+            (f["filename"], base64.b64decode(f["data"]), f.get("content_type"))
+            for f in (job.files or [])
+        ],
+    }
+    db.commit()
+    return claimed
+
+
+def finish_job(db: Session, job_id: uuid.UUID, status: str, error: Any = None):
+    """Record a terminal status and drop the image payload."""
+    job = db.get(AnalysisJob, job_id)
+    if job is None:
+        return
+    job.status = status
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    job.files = None
+    db.commit()
+
+
+def retry_job(db: Session, job_id: uuid.UUID, error: Any):
+    """Put a failed attempt back on the queue."""
+    job = db.get(AnalysisJob, job_id)
+    if job is None:
+        return
+    job.status = JOB_QUEUED
+    job.error = error
+    job.started_at = None
+    db.commit()
+
+
+def requeue_stale_jobs(db: Session, stale_after_seconds: float, max_attempts: int) -> int:
+    """
+    Return `running` jobs whose worker died (started too long ago) to the
+    queue. Jobs that already used `max_attempts` are marked failed instead.
+    """
+    now = datetime.utcnow()
+    stale = db.query(AnalysisJob).filter(
+        AnalysisJob.status == JOB_RUNNING,
+        AnalysisJob.started_at < now - timedelta(seconds=stale_after_seconds),
+    )
+    stale.filter(AnalysisJob.attempts >= max_attempts).update(
+        {
+            AnalysisJob.status: JOB_FAILED,
+            AnalysisJob.error: f"worker died on each of {max_attempts} attempts",
+            AnalysisJob.finished_at: now,
+            AnalysisJob.files: None,
+        },
+        synchronize_session=False,
+    )
+    count = stale.filter(AnalysisJob.attempts < max_attempts).update(
+        {AnalysisJob.status: JOB_QUEUED, AnalysisJob.started_at: None}, synchronize_session=False
+    )
+    db.commit()
+    return count
+
+
+def get_job(db: Session, job_id: uuid.UUID) -> Optional[Dict[str, Any]]:
+    job = db.get(AnalysisJob, job_id)
+    return job_status(job) if job else None
+
+
+def get_job_for_session(db: Session, session_id: uuid.UUID) -> Optional[Dict[str, Any]]:
+    job = db.query(AnalysisJob).filter(AnalysisJob.session_id == session_id).first()
+    return job_status(job) if job else None
+
+
+def queue_stats(db: Session) -> Dict[str, Any]:
+    """Job counts per status plus the age of the oldest queued job."""
+    counts = dict(
+        db.query(AnalysisJob.status, func.count(AnalysisJob.job_id))
+        .group_by(AnalysisJob.status)
+        .all()
+    )
+    oldest = db.query(func.min(AnalysisJob.created_at)).filter(AnalysisJob.status == JOB_QUEUED).scalar()
+    return {
+        "counts": {status: counts.get(status, 0) for status in JOB_STATUSES},
+        "queue_depth": counts.get(JOB_QUEUED, 0),
+        "oldest_queued_seconds": (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0,
+    }
@@ -0,0 +1,271 @@
+"""
+AgroVision Reference Image Index
+In-memory map of disease name -> golden reference blob, built from one GCS listing,
+plus a bounded byte/base64 cache of the reference images themselves
+"""
+
+import base64
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.schemas import DISEASE_REFERENCE_MAP
+
+# Extension preference when several files share a reference base path
+REFERENCE_EXTENSIONS = ['.jpg', '.JPG', '.jpeg', '.JPEG', '.png', '.PNG', '.webp', '.WEBP']
+
+
+def disease_key(disease_name: str) -> str:
+    """Case-folded lookup key for a disease name."""
+    return disease_name.strip().casefold()
+
+
+class ReferenceImageIndex:
+    """
+    Resolves DISEASE_REFERENCE_MAP entries to concrete blobs.
+
+    `build()` lists the `refs/` prefix once and picks, for every reference
+    base path, the first existing file in REFERENCE_EXTENSIONS order.
+    `lookup()` is a dict read - no network calls on the request path.
+    """
+
+    def __init__(self, storage_client, bucket_name: str, prefix: str = "refs/"):
+        self.storage_client = storage_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.built_at: Optional[float] = None
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at is not None
+
+    def public_url(self, blob_name: str) -> str:
+        return f"https://storage.googleapis.com/{self.bucket_name}/{blob_name}"
+
+    def build(self) -> int:
+        """
+        Rebuild the index from a single prefix listing. Blocking - run through
+        run_blocking. Returns the number of diseases resolved.
+        """
+        blobs_by_base: Dict[str, Dict[str, Any]] = {}
+        for blob in self.storage_client.list_blobs(self.bucket_name, prefix=self.prefix):
+            if '.' not in blob.name:
+                continue
+            base_path, ext = blob.name.rsplit('.', 1)
+            ext = f".{ext}"
+            if ext not in REFERENCE_EXTENSIONS:
+                continue
+            current = blobs_by_base.get(base_path)
+            if current is None or REFERENCE_EXTENSIONS.index(ext) < REFERENCE_EXTENSIONS.index(current["ext"]):
+                blobs_by_base[base_path] = {
+                    "ext": ext,
+                    "blob_name": blob.name,
+                    "generation": blob.generation,
+                    "etag": blob.etag,
+                    "content_type": blob.content_type,
+                }
+
+        entries = {}
+        for disease_name, ref_path in DISEASE_REFERENCE_MAP.items():
+            found = blobs_by_base.get(ref_path)
+            if not found:
+                print(f"❌ Reference image not found for {disease_name} at path: {ref_path}")
+                continue
+            entries[disease_key(disease_name)] = {
+                "disease_name": disease_name,
+                "blob_name": found["blob_name"],
+                "url": self.public_url(found["blob_name"]),
+                "generation": found["generation"],
+                "etag": found["etag"],
+                "content_type": found["content_type"],
+            }
+
+        with self._lock:
+            self._entries = entries
+            self.built_at = time.time()
+        print(f"📚 Reference index: {len(entries)}/{len(DISEASE_REFERENCE_MAP)} diseases resolved")
+        return len(entries)
+
+    def invalidate(self):
+        """Drop the index; lookups fall back until the next build()."""
+        with self._lock:
+            self._entries = {}
+            self.built_at = None
+
+    def lookup(self, disease_name: str) -> Optional[Dict[str, Any]]:
+        """Resolved blob entry for a disease (case-insensitive), or None."""
+        return self._entries.get(disease_key(disease_name))
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        """Snapshot of all resolved entries."""
+        return dict(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "resolved": len(self._entries),
+            "total_references": len(DISEASE_REFERENCE_MAP),
+            "built_at": self.built_at,
+        }
+
+
+class ReferenceImageCache:
+    """
+    Bounded cache of reference image bytes and their pre-encoded base64 payloads.
+
+    Entries are keyed by blob name + generation (falling back to ETag), so a
+    re-uploaded reference gets a new key and is fetched fresh. Bytes are also
+    written to `cache_dir` when set, so a restart warms from local disk
+    instead of GCS. The disk copy mirrors the memory entries: files are
+    removed when their entry is evicted or replaced, and `warm()` prunes
+    anything left over from earlier runs.
+    """
+
+    def __init__(self, storage_client, bucket_name: str, max_entries: int = 64, cache_dir: Optional[str] = None):
+        self.storage_client = storage_client
+        self.bucket_name = bucket_name
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self._payloads: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def cache_key(entry: Dict[str, Any]) -> str:
+        version = entry.get("generation") or entry.get("etag") or "unversioned"
+        return f"{entry['blob_name']}#{version}"
+
+    def _disk_path(self, key: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def _discard(self, keys) -> None:
+        """Remove the disk copies of dropped entries."""
+        for key in keys:
+            disk_path = self._disk_path(key)
+            if not disk_path:
+                return
+            try:
+                os.remove(disk_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"⚠️ Failed to remove cached reference {disk_path}: {e}")
+
+    def _remember(self, key: str, data: bytes, mime_type: Optional[str]) -> Dict[str, Any]:
+        payload = {
+            "mime_type": mime_type,
+            "data": base64.b64encode(data).decode("utf-8"),
+            "size": len(data),
+        }
+        blob_name = key.rsplit("#", 1)[0]
+        with self._lock:
+            # Older versions of a re-uploaded reference are never looked up again
+            dropped = [k for k in self._payloads if k != key and k.rsplit("#", 1)[0] == blob_name]
+            for old_key in dropped:
+                del self._payloads[old_key]
+            self._payloads[key] = payload
+            self._payloads.move_to_end(key)
+            while len(self._payloads) > self.max_entries:
+                dropped.append(self._payloads.popitem(last=False)[0])
+        self._discard(dropped)
+        return payload
+
+    def prune_disk(self) -> int:
+        """Delete disk files that no memory entry refers to. Returns the number removed."""
+        if not self.cache_dir:
+            return 0
+        with self._lock:
+            keep = {os.path.basename(self._disk_path(key)) for key in self._payloads}
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            # .tmp files may be a download in progress
+            if name in keep or name.endswith(".tmp"):
+                continue
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                removed += 1
+            except OSError as e:
+                print(f"⚠️ Failed to remove cached reference {name}: {e}")
+        return removed
+
+    def get(self, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Cached payload from memory or local disk. Never touches the network."""
+        key = self.cache_key(entry)
+        with self._lock:
+            payload = self._payloads.get(key)
+            if payload is not None:
+                self._payloads.move_to_end(key)
+                self.hits += 1
+                return payload
+
+        disk_path = self._disk_path(key)
+        if disk_path and os.path.exists(disk_path):
+            with open(disk_path, "rb") as f:
+                data = f.read()
+            self.hits += 1
+            return self._remember(key, data, entry.get("content_type"))
+
+        self.misses += 1
+        return None
+
+    def fetch(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Cached payload, downloading from GCS on a miss. Blocking - run through
+        run_blocking (or from warm()).
+        """
+        payload = self.get(entry)
+        if payload is not None:
+            return payload
+
+        key = self.cache_key(entry)
+        blob = self.storage_client.bucket(self.bucket_name).blob(entry["blob_name"])
+        data = blob.download_as_bytes()
+        self.downloads += 1
+
+        disk_path = self._disk_path(key)
+        if disk_path:
+            tmp_path = f"{disk_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, disk_path)
+        return self._remember(key, data, entry.get("content_type"))
+
+    def warm(self, entries: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Load every indexed reference into memory, then prune disk files of
+        references that are no longer cached. Blocking. Returns the number warmed.
+        """
+        warmed = 0
+        for entry in entries.values():
+            try:
+                self.fetch(entry)
+                warmed += 1
+            except Exception as e:
+                print(f"⚠️ Failed to cache reference {entry['blob_name']}: {e}")
+        pruned = self.prune_disk()
+        print(f"📚 Reference cache: {warmed}/{len(entries)} images warm, {pruned} stale disk files pruned")
+        return warmed
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._payloads),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "downloads": self.downloads,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "persistent": bool(self.cache_dir),
+            "disk_files": len(os.listdir(self.cache_dir)) if self.cache_dir else 0,
+        }
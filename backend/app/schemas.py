@@ -172,6 +172,22 @@ class ConsultationCreate(BaseModel):
         }
 
 
+class BatchAnalysisItem(BaseModel):
+    """
+    One consultation in an /analyze/batch manifest.
+    `files` name images uploaded in the same request (or inside the archive).
+    """
+    client_ref: Optional[str] = Field(None, max_length=100, description="Caller's own case ID, echoed in the result")
+    lat: float = Field(..., ge=-90, le=90, description="Latitude")
+    lon: float = Field(..., ge=-180, le=180, description="Longitude")
+    farmer_name: str = Field(..., min_length=1, max_length=100, description="Farmer's name")
+    village: str = Field(..., min_length=1, max_length=100, description="Village name")
+    crop_name: CropEnum = Field(..., description="Type of crop")
+    sown_date: Optional[str] = Field(None, description="Date when crop was sown")
+    observations: Optional[str] = Field(None, max_length=500, description="Farmer's observations about the issue")
+    files: List[str] = Field(..., min_length=1, max_length=3, description="Filenames of this case's images")
+
+
 # =============================================================================
 # API RESPONSE SCHEMAS
 # =============================================================================
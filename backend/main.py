@@ -11,22 +11,31 @@ Architecture:
 - Chat: Gemini 2.5 Pro - LIVE generation on every request
 """
 
+import io
 import os
 import uuid
 import json
 import base64
+import asyncio
+import time
+import hashlib
+import mimetypes
+import zipfile
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from collections import Counter
+from dataclasses import dataclass, field
 
-import requests
-from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException
+import httpx
+from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from google.cloud import storage
-from openai import OpenAI
+from openai import AsyncOpenAI
 import google.generativeai as genai
 from dotenv import load_dotenv
 
@@ -34,10 +43,48 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Local imports
-from app.database import get_db, Consultation, init_db
+from app.database import get_db, Consultation, init_db, SessionLocal
+from app.concurrency import run_blocking, shutdown_executor, SingleFlight
+from app.cache import TTLCache, CACHE_MISS
+from app.reference_index import ReferenceImageIndex, ReferenceImageCache
+from app.imaging import (
+    OUTPUT_FORMATS,
+    PreparedImage,
+    UndecodableImageError,
+    normalize_image,
+    assess_image_quality,
+    crop_to_leaf_region,
+    dhash,
+    summarize_preprocessing,
+)
+from app.diagnosis_cache import DiagnosisCache
+from app.chat_store import (
+    append_messages,
+    get_summary,
+    save_summary,
+    messages_between,
+    prompt_history,
+    migrate_legacy_histories,
+)
+from app.jobs import (
+    JOB_SUCCEEDED,
+    JOB_REJECTED,
+    JOB_FAILED,
+    IdempotencyKeyConflict,
+    enqueue_job,
+    claim_next_job,
+    finish_job,
+    retry_job,
+    requeue_stale_jobs,
+    get_job,
+    get_job_for_session,
+    queue_stats,
+)
+from app.embedding_index import EmbeddingIndex, image_features
 from app.schemas import (
     DISEASE_REFERENCE_MAP,
     DISEASES_BY_CROP,
+    BatchAnalysisItem,
     ConsultationResponse,
     CropEnum,
 )
@@ -54,23 +101,349 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is not set")
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+
+# Agent 1 ensemble: members run concurrently, each bounded by its own timeout
+AGENT1_ENSEMBLE_SIZE = int(os.getenv("AGENT1_ENSEMBLE_SIZE", "3"))
+AGENT1_MEMBER_TIMEOUT_SECONDS = float(os.getenv("AGENT1_MEMBER_TIMEOUT_SECONDS", "60"))
+
+# "adaptive" stops as soon as the majority winner is certain; "fixed" always runs every member
+AGENT1_ENSEMBLE_MODE = os.getenv("AGENT1_ENSEMBLE_MODE", "adaptive").lower()
+# Adaptive mode escalates to the remaining members if the leader is below this confidence
+AGENT1_ADAPTIVE_MIN_CONFIDENCE = float(os.getenv("AGENT1_ADAPTIVE_MIN_CONFIDENCE", "0.75"))
+
+
+@dataclass(frozen=True)
+class ScreenerTier:
+    """One model tier of the Agent 1 cascade."""
+    name: str
+    model: str
+    detail: str
+    client: AsyncOpenAI
+
+
+def build_screener_tier(name: str, prefix: str, default_model: str, default_detail: str) -> ScreenerTier:
+    """Build a cascade tier from <prefix>_MODEL / _DETAIL / _BASE_URL / _API_KEY env vars."""
+    base_url = os.getenv(f"{prefix}_BASE_URL") or None
+    api_key = os.getenv(f"{prefix}_API_KEY") or OPENAI_API_KEY
+    client = openai_client
+    if base_url or api_key != OPENAI_API_KEY:
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url or OPENAI_BASE_URL)
+    return ScreenerTier(
+        name=name,
+        model=os.getenv(f"{prefix}_MODEL", default_model),
+        detail=os.getenv(f"{prefix}_DETAIL", default_detail),
+        client=client,
+    )
+
+
+# Agent 1 cascade: a cheap first tier settles clear-cut cases, everything else
+# escalates to the full ensemble tier
+AGENT1_CASCADE_ENABLED = os.getenv("AGENT1_CASCADE_ENABLED", "true").lower() == "true"
+AGENT1_TIER1 = build_screener_tier("tier1", "AGENT1_TIER1", "gpt-4o-mini", "low")
+AGENT1_TIER2 = build_screener_tier("tier2", "AGENT1_TIER2", "gpt-4o", "high")
+# Tier 1 votes; with more than one, any disagreement counts as disputed and escalates
+AGENT1_TIER1_VOTES = int(os.getenv("AGENT1_TIER1_VOTES", "1"))
+# Tier 1 results below this confidence escalate
+AGENT1_TIER1_ACCEPT_CONFIDENCE = float(os.getenv("AGENT1_TIER1_ACCEPT_CONFIDENCE", "0.9"))
+# Escalate when tier 1 answers outside the crop's disease list (invalid image, uncertain, ...)
+AGENT1_ESCALATE_OFF_LIST = os.getenv("AGENT1_ESCALATE_OFF_LIST", "true").lower() == "true"
+
+# Agent 1 prompt: one crop-independent system message shared by every request
+# (so OpenAI prefix caching can reuse it), then a short per-crop block compiled
+# once per CropEnum value; the candidate list and images go last
+AGENT1_STATIC_SYSTEM_PROMPT = """You are an expert agricultural pathologist specializing in Tomato, Apple, and Rice crop diseases.
+
+SUPPORTED CROPS: Tomato, Apple, Rice ONLY
+The CURRENT CROP is named in the next instruction; its POSSIBLE DISEASES are listed in the user message.
+
+CRITICAL VALIDATION RULES (CHECK IN ORDER):
+
+1. IMAGE VALIDATION - REJECT IMMEDIATELY IF:
+   ❌ ANY image shows non-plant items (shoes, balls, people, animals, objects, etc.)
+   ❌ ANY image is NOT a leaf from the current crop
+   ❌ Images show leaves from other crops (if analyzing Tomato, reject Apple/Rice leaves)
+   → Return "Invalid Image - Not a Plant Leaf" with confidence 0.0
+
+2. CROP VERIFICATION:
+   ✓ All images must show leaves of the current crop specifically
+   ✓ Verify leaf shape, size, and structure matches the current crop
+   ✓ If images show wrong crop type, return "Invalid Image - Wrong Crop Type" with confidence 0.0
+
+3. DISEASE ANALYSIS (only if validation passes):
+   - Use ONLY diseases from the possible diseases list - no other diseases exist in our system
+   - If the leaf looks healthy, return exactly "<Current Crop> Healthy"
+   - Look for specific symptoms: lesion patterns, color, texture, distribution
+   - Be conservative: only >75% confidence if symptoms are VERY clear
+   - If unclear/blurry/poor lighting: "Uncertain - Need Better Images"
+
+4. EXACT DISEASE NAMES:
+   - Use EXACT names from the possible diseases list (case-sensitive)
+   - For healthy leaves: "<Current Crop> Healthy" (e.g., "Tomato Healthy", "Apple Healthy")
+   - Do not invent or modify disease names
+
+Return JSON with exactly these fields:
+{"disease_name": "Exact disease name from list OR 'Invalid Image - Not a Plant Leaf' OR 'Uncertain - Need Better Images'",
+"confidence": 0.0-1.0 (0.0 if invalid, >0.75 only if very clear symptoms),
+"visual_symptoms": "List specific observations OR 'Invalid image detected'",
+"preliminary_reasoning": "Explain symptoms OR why rejected"}
+
+Return ONLY valid JSON."""
+
+
+@dataclass(frozen=True)
+class ScreenerPrompt:
+    """Agent 1 system messages for one crop, compiled once."""
+    crop_name: str
+    system_messages: tuple
+    default_candidates: tuple
+
+
+def compile_screener_prompt(crop_name: str) -> ScreenerPrompt:
+    crop_block = f"""CURRENT CROP: {crop_name}
+All images must show {crop_name} leaves. The healthy label for this crop is exactly "{crop_name} Healthy"."""
+    return ScreenerPrompt(
+        crop_name=crop_name,
+        system_messages=(
+            {"role": "system", "content": AGENT1_STATIC_SYSTEM_PROMPT},
+            {"role": "system", "content": crop_block},
+        ),
+        default_candidates=tuple(DISEASES_BY_CROP.get(crop_name, [])),
+    )
+
+
+SCREENER_PROMPTS: Dict[str, ScreenerPrompt] = {crop.value: compile_screener_prompt(crop.value) for crop in CropEnum}
+
+
+def screener_messages(crop_name: str, candidate_diseases: Optional[List[str]], image_content: List[dict]) -> List[dict]:
+    """Static prefix + crop block, then the (possibly kNN-ranked) candidate list and the images."""
+    compiled = SCREENER_PROMPTS.get(crop_name) or compile_screener_prompt(crop_name)
+    possible_diseases = candidate_diseases or list(compiled.default_candidates)
+    disease_list = ", ".join(possible_diseases) if possible_diseases else "any plant disease"
+    return [
+        *compiled.system_messages,
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"Possible Diseases for {crop_name}: {disease_list}\n\n"
+                                         f"Analyze these {crop_name} plant images for diseases:"},
+                *image_content
+            ]
+        }
+    ]
+
+
+# Running totals of Agent 1 prompt tokens and how many were served from OpenAI's prompt cache
+agent1_prompt_stats = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
 
 # Google Gemini Configuration (for Chat only - Agent 2 verification disabled)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+# Static chat instructions - sent as the system instruction so every chat
+# request shares the same leading tokens (provider-side implicit caching)
+CHAT_SYSTEM_INSTRUCTION = """You are an expert agricultural AI assistant helping a farmer.
+
+Each message gives you the DIAGNOSIS CONTEXT of the farmer's consultation, then (when available) a summary of the earlier conversation and the most recent turns, and ends with the FARMER'S CURRENT QUESTION.
+
+CRITICAL INSTRUCTIONS:
+1. READ THE QUESTION CAREFULLY - answer what the farmer is actually asking
+2. If they ask "why" → explain the specific symptoms you observed
+3. If they ask "what treatment" → list specific actions and products
+4. If they ask "how to prevent" → give preventive measures
+5. If they ask "okay" or acknowledge → briefly confirm and ask if they need more help
+6. Keep answers FOCUSED and CONCISE (2-4 sentences max)
+7. Use simple, practical language a farmer can understand
+
+ANSWER THE QUESTION DIRECTLY - DO NOT give generic responses."""
+
 if not GEMINI_API_KEY:
     print("⚠️ WARNING: GEMINI_API_KEY not set. Chat will be disabled.")
     gemini_model = None
     gemini_chat_model = None
+    gemini_summary_model = None
 else:
     genai.configure(api_key=GEMINI_API_KEY)
     gemini_model = None  # Agent 2 verification disabled
-    gemini_chat_model = genai.GenerativeModel('gemini-2.5-pro')
+    # One shared chat model: static instructions + generation config fixed once
+    gemini_chat_model = genai.GenerativeModel(
+        'gemini-2.5-pro',
+        system_instruction=CHAT_SYSTEM_INSTRUCTION,
+        generation_config={
+            'temperature': 0.3,  # Some creativity but still focused
+            'top_p': 0.8,
+            'top_k': 40
+        }
+    )
+    # Background summaries of older chat turns - a fast model is plenty
+    gemini_summary_model = genai.GenerativeModel(
+        os.getenv("CHAT_SUMMARY_MODEL", "gemini-2.5-flash"),
+        generation_config={'temperature': 0.2}
+    )
     print("✅ Gemini 2.5 Pro configured for Chat")
 
 # Initialize GCS client
 storage_client = storage.Client()
 
+# Image uploads: run concurrently; large photos use chunked resumable uploads
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "3"))
+UPLOAD_RETRY_BACKOFF_SECONDS = float(os.getenv("UPLOAD_RETRY_BACKOFF_SECONDS", "0.5"))
+UPLOAD_RESUMABLE_THRESHOLD_BYTES = int(os.getenv("UPLOAD_RESUMABLE_THRESHOLD_BYTES", str(5 * 1024 * 1024)))
+# GCS requires chunk sizes in multiples of 256 KB
+UPLOAD_CHUNK_SIZE_BYTES = max(1, int(os.getenv("UPLOAD_CHUNK_SIZE_BYTES", str(1024 * 1024))) // (256 * 1024)) * 256 * 1024
+
+# Image normalization before storage and inference
+IMAGE_NORMALIZE_ENABLED = os.getenv("IMAGE_NORMALIZE_ENABLED", "true").lower() == "true"
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+if IMAGE_OUTPUT_FORMAT not in OUTPUT_FORMATS:
+    raise ValueError(f"IMAGE_OUTPUT_FORMAT must be one of {sorted(OUTPUT_FORMATS)}, got {IMAGE_OUTPUT_FORMAT!r}")
+IMAGE_OUTPUT_QUALITY = int(os.getenv("IMAGE_OUTPUT_QUALITY", "85"))
+# Keep the untouched upload under originals/<session_id>/ (optionally in another bucket)
+IMAGE_ARCHIVE_ORIGINALS = os.getenv("IMAGE_ARCHIVE_ORIGINALS", "false").lower() == "true"
+IMAGE_ARCHIVE_BUCKET = os.getenv("IMAGE_ARCHIVE_BUCKET", GCS_BUCKET_NAME)
+
+# Local quality gate: reject hopeless photos before any upload or model call
+QUALITY_GATE_ENABLED = os.getenv("QUALITY_GATE_ENABLED", "true").lower() == "true"
+QUALITY_MIN_SIDE = int(os.getenv("QUALITY_MIN_SIDE", "224"))
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "8.0"))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "30"))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "225"))
+QUALITY_MAX_CLIPPED_FRACTION = float(os.getenv("QUALITY_MAX_CLIPPED_FRACTION", "0.6"))
+
+# Leaf region-of-interest crop for the model's copy of each image (stored images stay whole)
+ROI_CROP_ENABLED = os.getenv("ROI_CROP_ENABLED", "true").lower() == "true"
+ROI_MIN_FOREGROUND = float(os.getenv("ROI_MIN_FOREGROUND", "0.02"))
+ROI_MAX_AREA_FRACTION = float(os.getenv("ROI_MAX_AREA_FRACTION", "0.85"))
+ROI_MIN_FILL = float(os.getenv("ROI_MIN_FILL", "0.25"))
+ROI_MARGIN = float(os.getenv("ROI_MARGIN", "0.06"))
+
+# Perceptual-hash diagnosis cache: near-identical resubmissions reuse the prior Agent 1 result
+DIAGNOSIS_CACHE_ENABLED = os.getenv("DIAGNOSIS_CACHE_ENABLED", "true").lower() == "true"
+diagnosis_cache = DiagnosisCache(
+    max_entries=int(os.getenv("DIAGNOSIS_CACHE_MAX_ENTRIES", "2000")),
+    ttl_seconds=float(os.getenv("DIAGNOSIS_CACHE_TTL_SECONDS", str(24 * 3600))),
+    max_distance=int(os.getenv("DIAGNOSIS_CACHE_MAX_HAMMING", "6")),
+)
+
+# Local colour/texture kNN over the golden references (plus confident past consultations).
+# Pre-ranks Agent 1's candidate list and, when enabled, short-circuits obvious matches.
+EMBEDDING_INDEX_ENABLED = os.getenv("EMBEDDING_INDEX_ENABLED", "true").lower() == "true"
+EMBEDDING_TOP_K = int(os.getenv("EMBEDDING_TOP_K", "3"))
+EMBEDDING_SHORT_CIRCUIT_ENABLED = os.getenv("EMBEDDING_SHORT_CIRCUIT_ENABLED", "false").lower() == "true"
+EMBEDDING_SHORT_CIRCUIT_SIMILARITY = float(os.getenv("EMBEDDING_SHORT_CIRCUIT_SIMILARITY", "0.97"))
+EMBEDDING_SHORT_CIRCUIT_MARGIN = float(os.getenv("EMBEDDING_SHORT_CIRCUIT_MARGIN", "0.05"))
+EMBEDDING_LEARN_MIN_CONFIDENCE = float(os.getenv("EMBEDDING_LEARN_MIN_CONFIDENCE", "0.9"))
+embedding_index = EmbeddingIndex(max_learned=int(os.getenv("EMBEDDING_MAX_LEARNED", "2000")))
+
+# Idempotency-Key support for /analyze: key -> outcome of the first attempt
+# ({"session_id"} or a replayable 4xx) with its request fingerprint, plus the
+# analyses still running as (fingerprint, task)
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+idempotency_cache = TTLCache(
+    "idempotency",
+    max_entries=int(os.getenv("IDEMPOTENCY_CACHE_MAX_ENTRIES", "10000")),
+    ttl_seconds=IDEMPOTENCY_TTL_SECONDS,
+    persist_path=os.getenv("IDEMPOTENCY_CACHE_PATH") or None,
+)
+idempotent_analyses: Dict[str, Tuple[str, asyncio.Task]] = {}
+
+# Concurrent /analyze requests with identical image bytes, crop and weather
+# grid cell share one preprocessing + upload + screening run
+ANALYSIS_COALESCING_ENABLED = os.getenv("ANALYSIS_COALESCING_ENABLED", "true").lower() == "true"
+analysis_flights = SingleFlight("analysis")
+
+# Chat: messages of recent conversation included in each prompt (last 2 Q&A pairs)
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "4"))
+# Prebuilt diagnosis context per session - it never changes after /analyze, so
+# a chat turn on a cached session skips the consultation query entirely
+chat_context_cache = TTLCache(
+    "chat_context",
+    max_entries=int(os.getenv("CHAT_CONTEXT_CACHE_MAX_ENTRIES", "1000")),
+    ttl_seconds=float(os.getenv("CHAT_CONTEXT_CACHE_TTL_SECONDS", str(6 * 3600))),
+)
+chat_context_db_stats = {"fetches": 0, "fetch_seconds": 0.0}
+# Rolling summary of turns older than the window, refreshed in the background
+# once a conversation passes CHAT_SUMMARY_THRESHOLD messages
+CHAT_SUMMARY_ENABLED = os.getenv("CHAT_SUMMARY_ENABLED", "true").lower() == "true"
+CHAT_SUMMARY_THRESHOLD = int(os.getenv("CHAT_SUMMARY_THRESHOLD", "8"))
+CHAT_SUMMARY_REFRESH_EVERY = int(os.getenv("CHAT_SUMMARY_REFRESH_EVERY", "4"))
+CHAT_SUMMARY_MAX_WORDS = int(os.getenv("CHAT_SUMMARY_MAX_WORDS", "150"))
+chat_summary_flights = SingleFlight("chat_summary")
+# Per-turn prompt size and provider cached-token totals
+chat_prompt_stats = {"turns": 0, "prompt_chars": 0, "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+chat_summary_tasks: set = set()
+
+# Asynchronous /analyze (Prefer: respond-async): jobs queue in Postgres and a
+# bounded pool of in-process workers runs them
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "900"))
+job_wakeup = asyncio.Event()
+
+# /analyze/batch: many consultations per request, streamed back as NDJSON
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_ARCHIVE_BYTES = int(os.getenv("BATCH_MAX_ARCHIVE_BYTES", str(200 * 1024 * 1024)))
+job_worker_stats = {"started_at": None, "busy": 0, "busy_seconds": 0.0, "processed": 0}
+
+# Golden reference images: resolved once from a `refs/` listing, refreshed in the background
+REFERENCE_INDEX_REFRESH_SECONDS = float(os.getenv("REFERENCE_INDEX_REFRESH_SECONDS", "3600"))
+reference_index = ReferenceImageIndex(storage_client, GCS_BUCKET_NAME)
+# Reference bytes + base64 payloads, warmed after every index build so
+# verification never downloads a reference on the hot path
+reference_image_cache = ReferenceImageCache(
+    storage_client,
+    GCS_BUCKET_NAME,
+    max_entries=int(os.getenv("REFERENCE_CACHE_MAX_ENTRIES", "64")),
+    cache_dir=os.getenv("REFERENCE_CACHE_DIR") or None,
+)
+
+# Shared async HTTP client for Open-Meteo, Geocoding and image downloads
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+http_client = httpx.AsyncClient(
+    timeout=HTTP_TIMEOUT_SECONDS,
+    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS),
+)
+
+# Weather cache: one Open-Meteo lookup per grid cell per date range.
+# 0.1° is roughly an 11 km cell - the same village shares one entry.
+WEATHER_GRID_DEGREES = float(os.getenv("WEATHER_GRID_DEGREES", "0.1"))
+weather_cache = TTLCache(
+    name="weather",
+    max_entries=int(os.getenv("WEATHER_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("WEATHER_CACHE_TTL_SECONDS", str(6 * 3600))),
+    persist_path=os.getenv("WEATHER_CACHE_PATH") or None,
+)
+OPEN_METEO_ARCHIVE_URL = os.getenv("OPEN_METEO_ARCHIVE_URL", "https://archive-api.open-meteo.com/v1/archive")
+
+# Reverse-geocoding cache: 0.01° buckets (~1 km) share one locality lookup.
+# Negative results ("no locality here") are cached for a shorter time.
+GEOCODE_GRID_DEGREES = float(os.getenv("GEOCODE_GRID_DEGREES", "0.01"))
+GEOCODE_NEGATIVE_TTL_SECONDS = float(os.getenv("GEOCODE_NEGATIVE_TTL_SECONDS", str(24 * 3600)))
+geocode_cache = TTLCache(
+    name="geocode",
+    max_entries=int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", "20000")),
+    ttl_seconds=float(os.getenv("GEOCODE_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+    persist_path=os.getenv("GEOCODE_CACHE_PATH") or None,
+)
+
+# Persistent caches only mark themselves dirty on writes; they are flushed to
+# disk every CACHE_FLUSH_INTERVAL_SECONDS and on shutdown
+PERSISTENT_CACHES = [cache for cache in (idempotency_cache, weather_cache, geocode_cache) if cache.persist_path]
+CACHE_FLUSH_INTERVAL_SECONDS = float(os.getenv("CACHE_FLUSH_INTERVAL_SECONDS", "30"))
+
+# Regional weather prefetch: refreshes the cache for grid cells with recent
+# consultations so the first farmer of the day doesn't wait on Open-Meteo
+WEATHER_PREFETCH_ENABLED = os.getenv("WEATHER_PREFETCH_ENABLED", "true").lower() == "true"
+WEATHER_PREFETCH_INTERVAL_SECONDS = float(os.getenv("WEATHER_PREFETCH_INTERVAL_SECONDS", "1800"))
+WEATHER_PREFETCH_LOOKBACK_HOURS = float(os.getenv("WEATHER_PREFETCH_LOOKBACK_HOURS", "72"))
+WEATHER_PREFETCH_MAX_REGIONS = int(os.getenv("WEATHER_PREFETCH_MAX_REGIONS", "200"))
+WEATHER_PREFETCH_CONCURRENCY = int(os.getenv("WEATHER_PREFETCH_CONCURRENCY", "8"))
+
 # =============================================================================
 # FASTAPI APP INITIALIZATION
 # =============================================================================
@@ -91,6 +464,10 @@ app.add_middleware(
 )
 
 
+# Long-running workers started on startup and cancelled on shutdown
+background_tasks: List[asyncio.Task] = []
+
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database tables on startup."""
@@ -100,160 +477,552 @@ async def startup_event():
     print("   🧠 Agent 2 Verification: DISABLED (using GPT-4o directly)")
     print(f"   💬 Chat: {'Gemini 2.5 Pro' if gemini_chat_model else 'DISABLED'}")
     print(f"   📦 GCS Bucket: {GCS_BUCKET_NAME}")
+    
+    await rebuild_reference_index()
+    background_tasks.append(asyncio.create_task(reference_index_refresh_loop()))
+    background_tasks.append(asyncio.create_task(migrate_chat_histories()))
+    
+    if WEATHER_PREFETCH_ENABLED:
+        background_tasks.append(asyncio.create_task(weather_prefetch_loop()))
+        print(f"   🌦️ Weather prefetch: every {WEATHER_PREFETCH_INTERVAL_SECONDS:.0f}s")
+    
+    if PERSISTENT_CACHES:
+        background_tasks.append(asyncio.create_task(cache_flush_loop()))
+    
+    if JOB_WORKERS > 0:
+        job_worker_stats["started_at"] = time.time()
+        for worker_id in range(JOB_WORKERS):
+            background_tasks.append(asyncio.create_task(analysis_job_worker(worker_id)))
+        print(f"   🧵 Analysis job workers: {JOB_WORKERS}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers, flush persistent caches, then close shared HTTP connections and executor threads."""
+    pending = background_tasks + list(chat_summary_tasks)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    await run_blocking(flush_caches)
+    await http_client.aclose()
+    shutdown_executor()
 
 
 # =============================================================================
 # UTILITY FUNCTIONS
 # =============================================================================
 
-def get_weather(lat: float, lon: float) -> str:
-    """Fetch past 7 days of weather from Open-Meteo Archive API."""
+def weather_grid_cell(lat: float, lon: float) -> tuple:
+    """Snap coordinates to the centre of their WEATHER_GRID_DEGREES cell."""
+    lat_cell = round(round(lat / WEATHER_GRID_DEGREES) * WEATHER_GRID_DEGREES, 4)
+    lon_cell = round(round(lon / WEATHER_GRID_DEGREES) * WEATHER_GRID_DEGREES, 4)
+    return lat_cell, lon_cell
+
+
+def weather_date_range() -> tuple:
+    """Past 7 days, as used for the weather summary."""
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=7)
+    return start_date, end_date
+
+
+def weather_cache_key(lat: float, lon: float) -> str:
+    """Cache key: grid cell + date range."""
+    lat_cell, lon_cell = weather_grid_cell(lat, lon)
+    start_date, end_date = weather_date_range()
+    return f"{lat_cell:.4f},{lon_cell:.4f}|{start_date.isoformat()}|{end_date.isoformat()}"
+
+
+async def fetch_weather_summary(lat: float, lon: float) -> str:
+    """Fetch past 7 days of weather from Open-Meteo Archive API. Raises on failure."""
+    start_date, end_date = weather_date_range()
+    
+    url = OPEN_METEO_ARCHIVE_URL
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "daily": "temperature_2m_max,rain_sum",
+        "timezone": "auto"
+    }
+    
+    response = await http_client.get(url, params=params)
+    response.raise_for_status()
+    data = response.json()
+    
+    daily = data.get("daily", {})
+    temps = daily.get("temperature_2m_max", [])
+    rain = daily.get("rain_sum", [])
+    
+    avg_temp = sum(t for t in temps if t is not None) / len(temps) if temps else 0
+    total_rain = sum(r for r in rain if r is not None) if rain else 0
+    
+    if total_rain > 50:
+        conditions = "Very Wet (Heavy Rain)"
+    elif total_rain > 20:
+        conditions = "Wet (Moderate Rain)"
+    elif total_rain > 5:
+        conditions = "Slightly Wet (Light Rain)"
+    else:
+        conditions = "Dry"
+    
+    humidity_note = ""
+    if total_rain > 30 and avg_temp > 20:
+        humidity_note = " - High humidity favorable for fungal diseases"
+    
+    summary = f"Avg Temp: {avg_temp:.1f}°C, Total Rain: {total_rain:.1f}mm, Conditions: {conditions}{humidity_note}"
+    return summary
+
+
+async def get_weather(lat: float, lon: float) -> str:
+    """
+    Weather summary for the farmer's grid cell, served from weather_cache when
+    possible. Failures are returned as text and never cached.
+    """
+    key = weather_cache_key(lat, lon)
+    cached = weather_cache.get(key)
+    if cached is not CACHE_MISS:
+        print(f"   ⚡ Weather cache hit: {key}")
+        return cached
+    
     try:
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=7)
-        
-        url = "https://archive-api.open-meteo.com/v1/archive"
-        params = {
-            "latitude": lat,
-            "longitude": lon,
-            "start_date": start_date.isoformat(),
-            "end_date": end_date.isoformat(),
-            "daily": "temperature_2m_max,rain_sum",
-            "timezone": "auto"
-        }
-        
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        daily = data.get("daily", {})
-        temps = daily.get("temperature_2m_max", [])
-        rain = daily.get("rain_sum", [])
-        
-        avg_temp = sum(t for t in temps if t is not None) / len(temps) if temps else 0
-        total_rain = sum(r for r in rain if r is not None) if rain else 0
-        
-        if total_rain > 50:
-            conditions = "Very Wet (Heavy Rain)"
-        elif total_rain > 20:
-            conditions = "Wet (Moderate Rain)"
-        elif total_rain > 5:
-            conditions = "Slightly Wet (Light Rain)"
-        else:
-            conditions = "Dry"
-        
-        humidity_note = ""
-        if total_rain > 30 and avg_temp > 20:
-            humidity_note = " - High humidity favorable for fungal diseases"
-        
-        summary = f"Avg Temp: {avg_temp:.1f}°C, Total Rain: {total_rain:.1f}mm, Conditions: {conditions}{humidity_note}"
+        lat_cell, lon_cell = weather_grid_cell(lat, lon)
+        summary = await fetch_weather_summary(lat_cell, lon_cell)
+        weather_cache.set(key, summary)
         return summary
         
     except Exception as e:
         return f"Weather data unavailable: {str(e)}"
 
 
-def upload_images(files: List[UploadFile], session_id: str) -> List[str]:
-    """Upload images to Google Cloud Storage."""
-    uploaded_urls = []
+def recent_consultation_cells(since: datetime, limit: int) -> List[tuple]:
+    """
+    Weather grid cells of recent consultations, most active first.
+    Blocking - call through run_blocking.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.query(Consultation.farmer_metadata).filter(
+            Consultation.created_at >= since
+        ).order_by(Consultation.created_at.desc()).limit(limit * 20).all()
+    finally:
+        db.close()
+    
+    cell_counts = Counter()
+    for (metadata,) in rows:
+        coords = (metadata or {}).get("coordinates") or {}
+        lat = coords.get("lat")
+        lon = coords.get("lng", coords.get("lon"))
+        if lat is None or lon is None:
+            continue
+        cell_counts[weather_grid_cell(float(lat), float(lon))] += 1
+    return [cell for cell, _ in cell_counts.most_common(limit)]
+
+
+async def prefetch_regional_weather() -> int:
+    """
+    Refresh weather_cache for active grid cells whose entry is missing or
+    would expire before the next prefetch run. Returns the number refreshed.
+    """
+    since = datetime.utcnow() - timedelta(hours=WEATHER_PREFETCH_LOOKBACK_HOURS)
+    cells = await run_blocking(recent_consultation_cells, since, WEATHER_PREFETCH_MAX_REGIONS)
+    
+    stale_cells = []
+    for lat_cell, lon_cell in cells:
+        expires_in = weather_cache.expires_in(weather_cache_key(lat_cell, lon_cell))
+        if expires_in is None or expires_in < WEATHER_PREFETCH_INTERVAL_SECONDS:
+            stale_cells.append((lat_cell, lon_cell))
+    
+    semaphore = asyncio.Semaphore(WEATHER_PREFETCH_CONCURRENCY)
+    
+    async def refresh(lat_cell: float, lon_cell: float) -> bool:
+        async with semaphore:
+            try:
+                summary = await fetch_weather_summary(lat_cell, lon_cell)
+            except Exception as e:
+                print(f"   ⚠️ Weather prefetch failed for {lat_cell},{lon_cell}: {e}")
+                return False
+            weather_cache.set(weather_cache_key(lat_cell, lon_cell), summary)
+            return True
+    
+    results = await asyncio.gather(*(refresh(lat, lon) for lat, lon in stale_cells))
+    return sum(results)
+
+
+async def weather_prefetch_loop():
+    """Background worker: prefetch regional weather every WEATHER_PREFETCH_INTERVAL_SECONDS."""
+    while True:
+        try:
+            refreshed = await prefetch_regional_weather()
+            if refreshed:
+                print(f"🌦️ Weather prefetch: refreshed {refreshed} regions")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Weather prefetch error: {e}")
+        await asyncio.sleep(WEATHER_PREFETCH_INTERVAL_SECONDS)
+
+
+def flush_caches() -> int:
+    """Write every dirty persistent cache to disk. Blocking. Returns the number written."""
+    return sum(cache.flush() for cache in PERSISTENT_CACHES)
+
+
+async def cache_flush_loop():
+    """Background worker: flush persistent caches every CACHE_FLUSH_INTERVAL_SECONDS."""
+    while True:
+        await asyncio.sleep(CACHE_FLUSH_INTERVAL_SECONDS)
+        try:
+            await run_blocking(flush_caches)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Cache flush error: {e}")
+
+
+def upload_file_to_gcs(bucket, blob_name: str, file_obj, content_type: Optional[str], size: Optional[int]) -> dict:
+    """
+    Upload one file with per-file retry. Files above UPLOAD_RESUMABLE_THRESHOLD_BYTES
+    are streamed as a chunked resumable upload instead of a single request.
+    Blocking - runs on the I/O executor. Returns timing info for the file.
+    """
+    started = time.perf_counter()
+    blob = bucket.blob(blob_name)
+    if size is None or size > UPLOAD_RESUMABLE_THRESHOLD_BYTES:
+        blob.chunk_size = UPLOAD_CHUNK_SIZE_BYTES
     
+    for attempt in range(1, UPLOAD_MAX_ATTEMPTS + 1):
+        try:
+            file_obj.seek(0)
+            blob.upload_from_file(file_obj, content_type=content_type, size=size)
+            break
+        except Exception as e:
+            if attempt == UPLOAD_MAX_ATTEMPTS:
+                raise
+            backoff = UPLOAD_RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1))
+            print(f"   ⚠️ Upload attempt {attempt} failed for {blob_name}: {e} - retrying in {backoff:.1f}s")
+            time.sleep(backoff)
+    file_obj.seek(0)
+    
+    return {
+        "blob_name": blob_name,
+        "bytes": size,
+        "attempts": attempt,
+        "resumable": blob.chunk_size is not None,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+async def read_uploads(files: List[UploadFile]) -> List[Tuple[str, bytes, Optional[str]]]:
+    """(filename, bytes, content_type) for each uploaded file."""
+    return [(file.filename or "image.jpg", await file.read(), file.content_type) for file in files]
+
+
+async def preprocess_images(raw_files: List[Tuple[str, bytes, Optional[str]]]) -> Tuple[List[PreparedImage], dict]:
+    """
+    Normalization stage before upload and inference: EXIF orientation,
+    downscale to IMAGE_MAX_EDGE, recompress, strip metadata, then (optionally)
+    score image quality and crop the model's copy to the leaf region. CPU work
+    runs on the I/O executor, one image per thread.
+    
+    The report's `quality_gate.passed` is False when any image is hopeless;
+    the caller rejects the request before uploading. An image Pillow cannot
+    decode fails the whole request with 415.
+    """
+    started = time.perf_counter()
+    
+    if not IMAGE_NORMALIZE_ENABLED:
+        images = [
+            PreparedImage(
+                filename=name,
+                content_type=content_type or "image/jpeg",
+                extension=name.rsplit(".", 1)[-1] if "." in name else "jpg",
+                data=data,
+                original_data=data,
+                original_content_type=content_type,
+                stats={"filename": name, "normalized": False, "original_bytes": len(data),
+                       "normalized_bytes": len(data), "bytes_saved": 0, "pixels_saved": 0},
+            )
+            for name, data, content_type in raw_files
+        ]
+    else:
+        try:
+            images = list(await asyncio.gather(*(
+                run_blocking(
+                    normalize_image, name, data, content_type,
+                    IMAGE_MAX_EDGE, IMAGE_OUTPUT_FORMAT, IMAGE_OUTPUT_QUALITY,
+                )
+                for name, data, content_type in raw_files
+            )))
+        except UndecodableImageError as e:
+            # Undecodable uploads can't be stripped of metadata - never store or forward them
+            raise HTTPException(
+                status_code=415,
+                detail={
+                    "error": "unsupported_image",
+                    "message": str(e),
+                    "suggestion": "Upload JPEG, PNG or WebP photos (set iPhone cameras to 'Most Compatible').",
+                },
+            )
+    
+    quality_gate = {"enabled": QUALITY_GATE_ENABLED, "passed": True, "rejected_images": []}
+    if QUALITY_GATE_ENABLED:
+        scores = await asyncio.gather(*(
+            run_blocking(
+                assess_image_quality, image,
+                min_side=QUALITY_MIN_SIDE,
+                min_sharpness=QUALITY_MIN_SHARPNESS,
+                min_brightness=QUALITY_MIN_BRIGHTNESS,
+                max_brightness=QUALITY_MAX_BRIGHTNESS,
+                max_clipped_fraction=QUALITY_MAX_CLIPPED_FRACTION,
+            )
+            for image in images
+        ))
+        quality_gate["rejected_images"] = [
+            {"image": idx + 1, "reasons": score["reasons"]}
+            for idx, score in enumerate(scores) if not score["passed"]
+        ]
+        quality_gate["passed"] = not quality_gate["rejected_images"]
+    
+    if ROI_CROP_ENABLED and quality_gate["passed"]:
+        images = list(await asyncio.gather(*(
+            run_blocking(
+                crop_to_leaf_region, image,
+                min_foreground=ROI_MIN_FOREGROUND,
+                max_area_fraction=ROI_MAX_AREA_FRACTION,
+                min_fill=ROI_MIN_FILL,
+                margin=ROI_MARGIN,
+                quality=IMAGE_OUTPUT_QUALITY,
+            )
+            for image in images
+        )))
+    
+    report = summarize_preprocessing(images, time.perf_counter() - started)
+    report["quality_gate"] = quality_gate
+    print(f"   🖼️ Preprocessed {len(images)} images: "
+          f"{report['total_original_bytes'] / 1024:.0f} KB -> {report['total_normalized_bytes'] / 1024:.0f} KB "
+          f"in {report['seconds']:.2f}s")
+    return images, report
+
+
+async def archive_originals(images: List[PreparedImage], session_id: str) -> List[str]:
+    """Store untouched originals under originals/<session_id>/ when IMAGE_ARCHIVE_ORIGINALS is on."""
+    bucket = storage_client.bucket(IMAGE_ARCHIVE_BUCKET)
+    blob_names = []
+    uploads = []
+    for idx, image in enumerate(images):
+        extension = image.filename.rsplit(".", 1)[-1] if "." in image.filename else "jpg"
+        blob_name = f"originals/{session_id}/image_{idx + 1}.{extension}"
+        blob_names.append(blob_name)
+        uploads.append(run_blocking(
+            upload_file_to_gcs, bucket, blob_name, io.BytesIO(image.original_data),
+            image.original_content_type, len(image.original_data)
+        ))
+    try:
+        await asyncio.gather(*uploads)
+    except Exception as e:
+        # Archiving is best-effort; the consultation doesn't depend on it
+        print(f"   ⚠️ Original archive failed: {e}")
+        return []
+    return blob_names
+
+
+async def upload_images(images: List[PreparedImage], session_id: str) -> Tuple[List[str], List[dict]]:
+    """
+    Upload images to Google Cloud Storage concurrently (blocking GCS calls run on the I/O executor).
+    Returns the public URLs in input order plus per-file timing.
+    """
     try:
         print(f"   📦 Connecting to GCS bucket: {GCS_BUCKET_NAME}")
         bucket = storage_client.bucket(GCS_BUCKET_NAME)
         
-        for idx, file in enumerate(files):
-            file_extension = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-            blob_name = f"{session_id}/image_{idx + 1}.{file_extension}"
-            
+        uploads = []
+        blob_names = []
+        for idx, image in enumerate(images):
+            blob_name = f"{session_id}/image_{idx + 1}.{image.extension}"
+            blob_names.append(blob_name)
             print(f"   📤 Uploading: {blob_name}")
-            blob = bucket.blob(blob_name)
-            blob.upload_from_file(file.file, content_type=file.content_type)
-            
-            # Use direct public URL (bucket must have public access at bucket level)
-            # or use authenticated URL for private buckets
-            public_url = f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{blob_name}"
-            uploaded_urls.append(public_url)
-            print(f"   ✅ Uploaded: {public_url}")
-            file.file.seek(0)
+            uploads.append(run_blocking(
+                upload_file_to_gcs, bucket, blob_name, io.BytesIO(image.data), image.content_type, len(image.data)
+            ))
+        
+        timings = list(await asyncio.gather(*uploads))
+        
+        # Use direct public URL (bucket must have public access at bucket level)
+        # or use authenticated URL for private buckets
+        uploaded_urls = [f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{name}" for name in blob_names]
+        for timing in timings:
+            print(f"   ✅ Uploaded: {timing['blob_name']} ({timing['seconds']:.2f}s, {timing['attempts']} attempt(s))")
         
         print(f"   ✅ All {len(uploaded_urls)} images uploaded successfully")
-        return uploaded_urls
+        return uploaded_urls, timings
         
     except Exception as e:
         print(f"   ❌ GCS Upload Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to upload images: {str(e)}")
 
 
-def get_location_name(lat: float, lon: float) -> Optional[str]:
-    """Get village/city name from coordinates using Google Geocoding API."""
+def estimate_upload_seconds_saved(preprocessing_report: dict, upload_timings: List[dict]) -> float:
+    """Bytes saved by preprocessing, priced at the upload throughput this request actually saw."""
+    uploaded_bytes = sum(t.get("bytes") or 0 for t in upload_timings)
+    upload_seconds = sum(t.get("seconds") or 0 for t in upload_timings)
+    if not uploaded_bytes or not upload_seconds:
+        return 0.0
+    seconds_per_byte = upload_seconds / uploaded_bytes
+    return round(max(preprocessing_report["total_bytes_saved"], 0) * seconds_per_byte, 3)
+
+
+def geocode_cache_key(lat: float, lon: float) -> str:
+    """Spatial bucket for reverse geocoding: coordinates snapped to GEOCODE_GRID_DEGREES."""
+    lat_cell = round(round(lat / GEOCODE_GRID_DEGREES) * GEOCODE_GRID_DEGREES, 5)
+    lon_cell = round(round(lon / GEOCODE_GRID_DEGREES) * GEOCODE_GRID_DEGREES, 5)
+    return f"{lat_cell:.5f},{lon_cell:.5f}"
+
+
+async def fetch_location_name(lat: float, lon: float, google_api_key: str) -> Optional[str]:
+    """Reverse-geocode via Google Geocoding API. Returns None if no locality; raises on failure."""
+    url = "https://maps.googleapis.com/maps/api/geocode/json"
+    params = {
+        "latlng": f"{lat},{lon}",
+        "key": google_api_key,
+        "result_type": "locality|sublocality|administrative_area_level_3"
+    }
+    
+    response = await http_client.get(url, params=params)
+    response.raise_for_status()
+    data = response.json()
+    
+    if data.get("status") == "OK" and data.get("results"):
+        for result in data["results"]:
+            for component in result.get("address_components", []):
+                types = component.get("types", [])
+                if "locality" in types or "sublocality" in types:
+                    return component.get("long_name")
+    return None
+
+
+async def get_location_name(lat: float, lon: float) -> Optional[str]:
+    """
+    Get village/city name from coordinates using Google Geocoding API.
+    Results are cached per grid bucket; "no locality" answers are cached too,
+    for GEOCODE_NEGATIVE_TTL_SECONDS. Transport errors are not cached.
+    """
     google_api_key = os.getenv("GOOGLE_MAPS_API_KEY")
     if not google_api_key:
         return None
     
+    key = geocode_cache_key(lat, lon)
+    cached = geocode_cache.get(key)
+    if cached is not CACHE_MISS:
+        return cached
+    
     try:
-        url = "https://maps.googleapis.com/maps/api/geocode/json"
-        params = {
-            "latlng": f"{lat},{lon}",
-            "key": google_api_key,
-            "result_type": "locality|sublocality|administrative_area_level_3"
-        }
-        
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data.get("status") == "OK" and data.get("results"):
-            for result in data["results"]:
-                for component in result.get("address_components", []):
-                    types = component.get("types", [])
-                    if "locality" in types or "sublocality" in types:
-                        return component.get("long_name")
-        return None
-        
+        location_name = await fetch_location_name(lat, lon, google_api_key)
     except Exception:
         return None
+    
+    if location_name is None:
+        geocode_cache.set(key, None, ttl_seconds=GEOCODE_NEGATIVE_TTL_SECONDS)
+    else:
+        geocode_cache.set(key, location_name)
+    return location_name
 
 
 def get_reference_image_url(disease_name: str) -> Optional[str]:
-    """Get the public URL for a disease reference image. Case-insensitive lookup."""
-    disease_name_lower = disease_name.lower().strip()
-    
-    matched_key = None
-    for key in DISEASE_REFERENCE_MAP.keys():
-        if key.lower().strip() == disease_name_lower:
-            matched_key = key
-            break
-    
-    if not matched_key:
+    """Get the public URL for a disease reference image. Case-insensitive, served from reference_index."""
+    entry = reference_index.lookup(disease_name)
+    if not entry:
+        if not reference_index.ready:
+            print(f"⚠️ Reference index not built yet - no reference for {disease_name}")
         return None
-    
-    ref_path = DISEASE_REFERENCE_MAP[matched_key]
-    
+    return entry["url"]
+
+
+async def rebuild_reference_index():
+    """Rebuild reference_index from a single GCS listing and warm the reference byte cache, off the event loop."""
     try:
-        bucket = storage_client.bucket(GCS_BUCKET_NAME)
-        base_path = ref_path.rsplit('.', 1)[0] if '.' in ref_path else ref_path
-        extensions = ['.jpg', '.JPG', '.jpeg', '.JPEG', '.png', '.PNG', '.webp', '.WEBP']
-        
-        for ext in extensions:
-            test_path = f"{base_path}{ext}"
-            blob = bucket.blob(test_path)
-            if blob.exists():
-                print(f"✅ Found reference image: {test_path}")
-                return f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{test_path}"
-        
-        # If no extension works, return None instead of broken URL
-        print(f"❌ Reference image not found for {disease_name} at path: {base_path}")
-        print(f"   Tried extensions: {extensions}")
+        await run_blocking(reference_index.build)
+        await run_blocking(reference_image_cache.warm, reference_index.entries())
+    except Exception as e:
+        print(f"⚠️ Reference index build failed: {e}")
+        return
+    if EMBEDDING_INDEX_ENABLED:
+        await run_blocking(build_embedding_index)
+
+
+def build_embedding_index():
+    """Compute a feature vector for every warm reference image and swap them into embedding_index. Blocking."""
+    vectors = {}
+    for entry in reference_index.entries().values():
+        payload = reference_image_cache.get(entry)
+        if payload is None:
+            continue
+        vector = image_features(base64.b64decode(payload["data"]))
+        if vector is not None:
+            vectors[entry["disease_name"]] = vector
+    embedding_index.set_references(vectors)
+    print(f"🧭 Embedding index: {len(vectors)} reference vectors")
+
+
+async def local_preclassify(images: List[PreparedImage], crop_name: str) -> dict:
+    """
+    Local kNN pass over the (leaf-cropped) images against the crop's diseases.
+    Returns top-k `suggestions`, the crop's disease list re-ranked by similarity
+    (`ranked_candidates`), per-disease `scores` and the image `vectors` for
+    learning later. Empty dict when disabled or no references are indexed.
+    """
+    if not EMBEDDING_INDEX_ENABLED or not embedding_index.stats()["reference_vectors"]:
+        return {}
+    started = time.perf_counter()
+    vectors = await asyncio.gather(*(
+        run_blocking(image_features, image.model_data or image.data) for image in images
+    ))
+    vectors = [v for v in vectors if v is not None]
+    crop_diseases = DISEASES_BY_CROP.get(crop_name, [])
+    scored = embedding_index.query(vectors, candidates=crop_diseases, k=len(crop_diseases))
+    ranked = [s["disease"] for s in scored]
+    return {
+        "suggestions": scored[:EMBEDDING_TOP_K],
+        "ranked_candidates": (ranked + [d for d in crop_diseases if d not in ranked]) if ranked else None,
+        "scores": {s["disease"]: s["similarity"] for s in scored},
+        "vectors": vectors,
+        "seconds": round(time.perf_counter() - started, 4),
+    }
+
+
+async def get_reference_image_part(disease_name: str) -> Optional[dict]:
+    """
+    Gemini image part ({"mime_type", "data"}) for a disease's golden reference.
+    Served from reference_image_cache; only a cold entry falls back to GCS.
+    """
+    entry = reference_index.lookup(disease_name)
+    if not entry:
         return None
-        
-    except Exception:
-        return f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{ref_path}"
+    payload = reference_image_cache.get(entry)
+    if payload is None:
+        try:
+            payload = await run_blocking(reference_image_cache.fetch, entry)
+        except Exception as e:
+            print(f"Failed to download reference {entry['blob_name']}: {str(e)}")
+            return None
+    return {
+        "mime_type": payload["mime_type"] or get_image_mime_type(entry["url"]),
+        "data": payload["data"]
+    }
 
 
-def download_image_as_base64(url: str) -> Optional[str]:
+async def reference_index_refresh_loop():
+    """Background worker: rebuild the reference index every REFERENCE_INDEX_REFRESH_SECONDS."""
+    while True:
+        await asyncio.sleep(REFERENCE_INDEX_REFRESH_SECONDS)
+        await rebuild_reference_index()
+
+
+async def download_image_as_base64(url: str) -> Optional[str]:
     """Download an image from URL and return as base64."""
     try:
-        response = requests.get(url, timeout=15)
+        response = await http_client.get(url, timeout=15)
         response.raise_for_status()
         return base64.b64encode(response.content).decode('utf-8')
     except Exception as e:
@@ -271,121 +1040,226 @@ def get_image_mime_type(url: str) -> str:
     return 'image/jpeg'
 
 
+def save_consultation(db: Session, consultation: Consultation) -> Consultation:
+    """Persist a consultation. Blocking - call through run_blocking from endpoints."""
+    db.add(consultation)
+    db.commit()
+    db.refresh(consultation)
+    chat_context_cache.delete(str(consultation.session_id))
+    return consultation
+
+
+def fetch_consultation(db: Session, session_uuid: uuid.UUID) -> Optional[Consultation]:
+    """Load a consultation by id. Blocking - call through run_blocking from endpoints."""
+    return db.query(Consultation).filter(
+        Consultation.session_id == session_uuid
+    ).first()
+
+
 # =============================================================================
 # DUAL-AGENT AI PIPELINE
 # =============================================================================
 
-def agent1_openai_screener(image_urls: List[str], crop_name: str, run_ensemble: bool = False) -> dict:
+def agent1_error_result(message: str, agent: str = "OpenAI GPT-4o") -> dict:
+    """Agent 1 result used when a screening call fails or times out."""
+    return {
+        "disease_name": "Error",
+        "confidence": 0.0,
+        "visual_symptoms": f"Agent 1 error: {message}",
+        "preliminary_reasoning": "",
+        "agent": agent,
+        "status": "error"
+    }
+
+
+def record_agent1_usage(usage) -> dict:
+    """Prompt/cached/completion token counts of one OpenAI response, added to agent1_prompt_stats."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    counts = {
+        "calls": 1,
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+    for key, value in counts.items():
+        agent1_prompt_stats[key] += value
+    return counts
+
+
+def sum_prompt_usage(results: List[dict]) -> dict:
+    """Combined prompt_usage of several Agent 1 calls, with the cached share of prompt tokens."""
+    total = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+    for result in results:
+        for key, value in (result.get("prompt_usage") or {}).items():
+            if key in total:
+                total[key] += value
+    total["cached_ratio"] = round(total["cached_tokens"] / total["prompt_tokens"], 4) if total["prompt_tokens"] else 0.0
+    return total
+
+
+def tally_ensemble_votes(results: List[dict], ensemble_size: Optional[int] = None) -> dict:
+    """
+    Majority vote over Agent 1 ensemble results.
+    Picks the most common disease (ties go to the earliest member), keeps the
+    highest-confidence result for it and boosts confidence only when every
+    member of the full `ensemble_size` (default: len(results)) agreed - an
+    early-exit majority is not unanimous.
+    """
+    ensemble_size = ensemble_size or len(results)
+    diseases = [r['disease_name'] for r in results]
+    vote_counts = Counter(diseases)
+    top_disease, vote_count = vote_counts.most_common(1)[0]
+    
+    # Get highest confidence result for the winning disease
+    winning_results = [r for r in results if r['disease_name'] == top_disease]
+    best_result = dict(max(winning_results, key=lambda x: x['confidence']))
+    
+    # Boost confidence if unanimous
+    unanimous = vote_count == ensemble_size
+    consensus_boost = 0.05 if unanimous else 0.0
+    best_result['confidence'] = min(best_result['confidence'] + consensus_boost, 0.99)
+    best_result['ensemble_unanimous'] = unanimous
+    
+    best_result['ensemble_votes'] = f"{vote_count}/{len(results)}"
+    best_result['ensemble_calls'] = len(results)
+    best_result['all_predictions'] = diseases
+    best_result['prompt_usage'] = sum_prompt_usage(results)
+    return best_result
+
+
+def majority_is_certain(results: List[dict], ensemble_size: int) -> bool:
+    """
+    True when the remaining ensemble members can no longer change the
+    Counter.most_common winner, i.e. the leader beats the runner-up even if
+    every outstanding vote went to the runner-up.
+    """
+    ranked = Counter(r['disease_name'] for r in results).most_common(2)
+    top_votes = ranked[0][1]
+    runner_up_votes = ranked[1][1] if len(ranked) > 1 else 0
+    remaining = ensemble_size - len(results)
+    return top_votes > runner_up_votes + remaining
+
+
+async def run_ensemble_members(
+    image_urls: List[str],
+    crop_name: str,
+    count: int,
+    member_timeout: float,
+    tier: Optional[ScreenerTier] = None,
+    candidate_diseases: Optional[List[str]] = None,
+) -> List[dict]:
+    """Run `count` independent Agent 1 calls concurrently, preserving member order."""
+    return list(await asyncio.gather(*(
+        agent1_openai_screener(
+            image_urls, crop_name, member_timeout=member_timeout, tier=tier,
+            candidate_diseases=candidate_diseases,
+        )
+        for _ in range(count)
+    )))
+
+
+async def run_adaptive_ensemble(
+    image_urls: List[str],
+    crop_name: str,
+    ensemble_size: int,
+    member_timeout: float,
+    tier: Optional[ScreenerTier] = None,
+    candidate_diseases: Optional[List[str]] = None,
+) -> List[dict]:
+    """
+    Early-exit ensemble: start with the smallest number of votes that could
+    form a majority and only escalate to the remaining members when the first
+    round disagrees or the winner's confidence is below AGENT1_ADAPTIVE_MIN_CONFIDENCE.
+    """
+    majority = ensemble_size // 2 + 1
+    results = await run_ensemble_members(image_urls, crop_name, majority, member_timeout, tier, candidate_diseases)
+    
+    if len(results) < ensemble_size:
+        # Partial tally: never boosted, so this compares raw member confidence
+        leader = tally_ensemble_votes(results, ensemble_size)
+        confident = leader['confidence'] >= AGENT1_ADAPTIVE_MIN_CONFIDENCE
+        if majority_is_certain(results, ensemble_size) and confident:
+            print(f"   ⚡ Early exit: majority certain after {len(results)}/{ensemble_size} calls")
+        else:
+            reason = "disagreement" if not majority_is_certain(results, ensemble_size) else "low confidence"
+            print(f"   🔁 Escalating ensemble ({reason}): {ensemble_size - len(results)} more calls")
+            results += await run_ensemble_members(
+                image_urls, crop_name, ensemble_size - len(results), member_timeout, tier, candidate_diseases
+            )
+    return results
+
+
+def is_unanimous(agent1_result: dict) -> bool:
+    """True when every member of the full ensemble voted for the winning disease (e.g. '3/3' of 3)."""
+    return bool(agent1_result.get('ensemble_unanimous'))
+
+
+async def agent1_openai_screener(
+    image_urls: List[str],
+    crop_name: str,
+    run_ensemble: bool = False,
+    ensemble_size: Optional[int] = None,
+    member_timeout: Optional[float] = None,
+    tier: Optional[ScreenerTier] = None,
+    candidate_diseases: Optional[List[str]] = None,
+) -> dict:
     """
     AGENT 1: OpenAI GPT-4o - Initial Visual Screener
     Analyzes user images to predict disease name and confidence.
     
     Args:
-        image_urls: List of image URLs to analyze
+        image_urls: Image URLs (or inline data URLs) to analyze
         crop_name: Name of the crop
-        run_ensemble: If True, runs 3x and uses majority vote (95%+ accuracy)
+        run_ensemble: If True, runs the ensemble concurrently and uses majority vote (95%+ accuracy)
+        ensemble_size: Number of ensemble members (defaults to AGENT1_ENSEMBLE_SIZE)
+        member_timeout: Per-call timeout in seconds (defaults to AGENT1_MEMBER_TIMEOUT_SECONDS)
+        tier: Model tier to call (defaults to the full AGENT1_TIER2 model)
+        candidate_diseases: Crop diseases pre-ranked by the local kNN (defaults to DISEASES_BY_CROP order)
     """
-    if not run_ensemble:
-        print("🤖 Agent 1 (GPT-4o): Starting visual screening...")
+    member_timeout = member_timeout or AGENT1_MEMBER_TIMEOUT_SECONDS
+    tier = tier or AGENT1_TIER2
+    agent_label = f"OpenAI {tier.model}"
     
     if run_ensemble:
-        print("🔬 ENSEMBLE MODE: Running 3 independent Agent 1 analyses...")
-        results = []
-        for i in range(3):
-            result = agent1_openai_screener(image_urls, crop_name, run_ensemble=False)
-            results.append(result)
-            print(f"   Run {i+1}/3: {result['disease_name']} ({result['confidence']:.0%})")
-        
-        # Majority voting
-        from collections import Counter
-        diseases = [r['disease_name'] for r in results]
-        vote_counts = Counter(diseases)
-        top_disease, vote_count = vote_counts.most_common(1)[0]
-        
-        # Get highest confidence result for the winning disease
-        winning_results = [r for r in results if r['disease_name'] == top_disease]
-        best_result = max(winning_results, key=lambda x: x['confidence'])
-        
-        # Boost confidence if unanimous (3/3 votes)
-        consensus_boost = 0.05 if vote_count == 3 else 0.0
-        best_result['confidence'] = min(best_result['confidence'] + consensus_boost, 0.99)
-        
-        print(f"   ✅ CONSENSUS: {top_disease} ({vote_count}/3 votes, {best_result['confidence']:.0%} confidence)")
+        ensemble_size = max(1, ensemble_size or AGENT1_ENSEMBLE_SIZE)
+        if AGENT1_ENSEMBLE_MODE == "adaptive":
+            print(f"🔬 ENSEMBLE MODE (adaptive): Up to {ensemble_size} Agent 1 analyses...")
+            results = await run_adaptive_ensemble(
+                image_urls, crop_name, ensemble_size, member_timeout, tier, candidate_diseases
+            )
+        else:
+            print(f"🔬 ENSEMBLE MODE: Running {ensemble_size} concurrent Agent 1 analyses...")
+            results = await run_ensemble_members(
+                image_urls, crop_name, ensemble_size, member_timeout, tier, candidate_diseases
+            )
+        for i, result in enumerate(results):
+            print(f"   Run {i+1}/{len(results)}: {result['disease_name']} ({result['confidence']:.0%})")
         
-        best_result['ensemble_votes'] = f"{vote_count}/3"
-        best_result['all_predictions'] = diseases
+        best_result = tally_ensemble_votes(results, ensemble_size)
+        print(f"   ✅ CONSENSUS: {best_result['disease_name']} ({best_result['ensemble_votes']} votes, {best_result['confidence']:.0%} confidence)")
         return best_result
     
-    print("🤖 Agent 1 (GPT-4o): Starting visual screening...")
+    print(f"🤖 Agent 1 ({tier.model}): Starting visual screening...")
     
     try:
         image_content = []
         for url in image_urls:
             image_content.append({
                 "type": "image_url",
-                "image_url": {"url": url, "detail": "high"}
+                "image_url": {"url": url, "detail": tier.detail}
             })
         
-        possible_diseases = DISEASES_BY_CROP.get(crop_name, [])
-        disease_list = ", ".join(possible_diseases) if possible_diseases else "any plant disease"
+        messages = screener_messages(crop_name, candidate_diseases, image_content)
         
-        messages = [
-            {
-                "role": "system",
-                "content": f"""You are an expert agricultural pathologist specializing in Tomato, Apple, and Rice crop diseases.
-
-SUPPORTED CROPS: Tomato, Apple, Rice ONLY
-Current Crop: {crop_name}
-Possible Diseases for {crop_name}: {disease_list}
-
-CRITICAL VALIDATION RULES (CHECK IN ORDER):
-
-1. IMAGE VALIDATION - REJECT IMMEDIATELY IF:
-   ❌ ANY image shows non-plant items (shoes, balls, people, animals, objects, etc.)
-   ❌ ANY image is NOT a leaf from {crop_name} plant
-   ❌ Images show leaves from other crops (if analyzing Tomato, reject Apple/Rice leaves)
-   → Return "Invalid Image - Not a Plant Leaf" with confidence 0.0
-
-2. CROP VERIFICATION:
-   ✓ All images must show {crop_name} leaves specifically
-   ✓ Verify leaf shape, size, and structure matches {crop_name}
-   ✓ If images show wrong crop type, return "Invalid Image - Wrong Crop Type" with confidence 0.0
-
-3. DISEASE ANALYSIS (only if validation passes):
-   - Use ONLY diseases from the list above - no other diseases exist in our system
-   - If the leaf looks healthy, return exactly "{crop_name} Healthy"
-   - Look for specific symptoms: lesion patterns, color, texture, distribution
-   - Be conservative: only >75% confidence if symptoms are VERY clear
-   - If unclear/blurry/poor lighting: "Uncertain - Need Better Images"
-
-4. EXACT DISEASE NAMES:
-   - Use EXACT names from the list above (case-sensitive)
-   - For healthy leaves: "{crop_name} Healthy" (e.g., "Tomato Healthy", "Apple Healthy")
-   - Do not invent or modify disease names
-
-Return JSON with exactly these fields:
-{{"disease_name": "Exact disease name from list OR 'Invalid Image - Not a Plant Leaf' OR 'Uncertain - Need Better Images'",
-"confidence": 0.0-1.0 (0.0 if invalid, >0.75 only if very clear symptoms),
-"visual_symptoms": "List specific observations OR 'Invalid image detected'",
-"preliminary_reasoning": "Explain symptoms OR why rejected"}}
-
-Return ONLY valid JSON."""
-            },
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": f"Analyze these {crop_name} plant images for diseases:"},
-                    *image_content
-                ]
-            }
-        ]
-        
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            max_tokens=800,
-            temperature=0.0,  # Deterministic: same input = same output
-            response_format={"type": "json_object"}  # Force valid JSON
+        response = await asyncio.wait_for(
+            tier.client.chat.completions.create(
+                model=tier.model,
+                messages=messages,
+                max_tokens=800,
+                temperature=0.0,  # Deterministic: same input = same output
+                response_format={"type": "json_object"}  # Force valid JSON
+            ),
+            timeout=member_timeout,
         )
         
         result_text = response.choices[0].message.content.strip()
@@ -399,29 +1273,183 @@ Return ONLY valid JSON."""
         
         result = json.loads(result_text)
         
-        print(f"🤖 Agent 1 Result: {result.get('disease_name')} ({result.get('confidence', 0):.0%})")
+        usage = record_agent1_usage(getattr(response, "usage", None))
+        print(f"🤖 Agent 1 Result: {result.get('disease_name')} ({result.get('confidence', 0):.0%}) "
+              f"[{usage['cached_tokens']}/{usage['prompt_tokens']} prompt tokens cached]")
         
         return {
             "disease_name": result.get("disease_name", "Unknown Disease"),
             "confidence": float(result.get("confidence", 0.5)),
             "visual_symptoms": result.get("visual_symptoms", ""),
             "preliminary_reasoning": result.get("preliminary_reasoning", ""),
-            "agent": "OpenAI GPT-4o",
-            "status": "success"
+            "agent": agent_label,
+            "status": "success",
+            "prompt_usage": usage,
         }
         
+    except asyncio.TimeoutError:
+        print(f"   ⏱️ Agent 1 call timed out after {member_timeout:.0f}s")
+        return agent1_error_result(f"timed out after {member_timeout:.0f}s", agent_label)
     except Exception as e:
-        return {
-            "disease_name": "Error",
-            "confidence": 0.0,
-            "visual_symptoms": f"Agent 1 error: {str(e)}",
-            "preliminary_reasoning": "",
-            "agent": "OpenAI GPT-4o",
-            "status": "error"
-        }
+        return agent1_error_result(str(e), agent_label)
+
+
+async def screen_with_diagnosis_cache(
+    images: List[PreparedImage],
+    crop_name: str,
+    session_id: str,
+    knn: Optional[dict] = None,
+) -> dict:
+    """
+    Agent 1 screening with perceptual-hash reuse. A near-identical image set for
+    the same crop (within DIAGNOSIS_CACHE_MAX_HAMMING bits per image, inside the
+    TTL) returns the earlier result marked `served_from_cache`; otherwise an
+    obvious local kNN match may short-circuit the models, or the cascade runs
+    with the kNN-ranked candidate list. Successful model results are remembered.
+    """
+    hashes = None
+    if DIAGNOSIS_CACHE_ENABLED:
+        hashes = list(await asyncio.gather(*(run_blocking(dhash, image) for image in images)))
+        if any(h is None for h in hashes):
+            hashes = None
+    
+    if hashes is not None:
+        cached = diagnosis_cache.lookup(crop_name, hashes)
+        if cached:
+            print(f"   ⚡ Diagnosis cache hit: session {cached['session_id']} (distance {cached['distance']})")
+            result = json.loads(json.dumps(cached["agent1_result"]))
+            # No model was called for this request: the source's ensemble
+            # bookkeeping is kept separately instead of being reported as ours
+            result["cache_source_ensemble"] = {
+                field: result.pop(field, None)
+                for field in ("ensemble_calls", "ensemble_votes", "ensemble_unanimous",
+                              "all_predictions", "tier_path", "escalation_reason")
+            }
+            result.update(
+                served_from_cache=True,
+                ensemble_calls=0,
+                all_predictions=[result["disease_name"]],
+                tier_path=["diagnosis_cache"],
+                escalation_reason=None,
+                prompt_usage=sum_prompt_usage([]),
+            )
+            result["cache_source_session"] = cached["session_id"]
+            result["cache_hamming_distance"] = cached["distance"]
+            return result
+    
+    knn = knn or {}
+    shortcut = knn_short_circuit_result(knn)
+    if shortcut:
+        print(f"   ⚡ Local kNN short-circuit: {shortcut['disease_name']} ({shortcut['confidence']:.0%})")
+        shortcut["served_from_cache"] = False
+        return shortcut
+    
+    # The model gets the leaf-cropped copies inline; stored image_urls stay full-frame
+    model_inputs = [image.model_data_url() for image in images]
+    result = await agent1_cascade_screener(model_inputs, crop_name, knn.get("ranked_candidates"))
+    result["served_from_cache"] = False
+    if hashes is not None and result.get("status") == "success":
+        diagnosis_cache.store(crop_name, hashes, session_id, result)
+    return result
+
+
+def knn_short_circuit_result(knn: dict) -> Optional[dict]:
+    """
+    Agent 1-shaped result straight from the local kNN when the best reference
+    match is both strong and clearly ahead of the runner-up. Off unless
+    EMBEDDING_SHORT_CIRCUIT_ENABLED.
+    """
+    suggestions = knn.get("suggestions") or []
+    if not EMBEDDING_SHORT_CIRCUIT_ENABLED or not suggestions:
+        return None
+    top = suggestions[0]
+    runner_up = suggestions[1]["similarity"] if len(suggestions) > 1 else 0.0
+    if top["similarity"] < EMBEDDING_SHORT_CIRCUIT_SIMILARITY:
+        return None
+    if top["similarity"] - runner_up < EMBEDDING_SHORT_CIRCUIT_MARGIN:
+        return None
+    return {
+        "disease_name": top["disease"],
+        "confidence": min(top["similarity"], 0.95),
+        "visual_symptoms": f"Local reference match (cosine similarity {top['similarity']:.2f})",
+        "preliminary_reasoning": "Colour/texture features closely match the golden reference image.",
+        "agent": "Local kNN",
+        "status": "success",
+        "ensemble_calls": 0,
+        "all_predictions": [top["disease"]],
+        "tier_path": ["local_knn"],
+        "escalation_reason": None,
+        "prompt_usage": sum_prompt_usage([]),
+    }
 
 
-def verify_disease_strict(
+def tier1_escalation_reason(results: List[dict], crop_name: str) -> Optional[str]:
+    """Return why a tier 1 verdict must escalate to the full ensemble, or None to accept it."""
+    if any(r.get("status") != "success" for r in results):
+        return "tier1_error"
+    if len({r["disease_name"] for r in results}) > 1:
+        return "tier1_disputed"
+    leader = max(results, key=lambda r: r["confidence"])
+    if leader["confidence"] < AGENT1_TIER1_ACCEPT_CONFIDENCE:
+        return "tier1_low_confidence"
+    if AGENT1_ESCALATE_OFF_LIST and leader["disease_name"] not in DISEASES_BY_CROP.get(crop_name, []):
+        return "tier1_off_list"
+    return None
+
+
+async def agent1_cascade_screener(
+    image_urls: List[str],
+    crop_name: str,
+    candidate_diseases: Optional[List[str]] = None,
+) -> dict:
+    """
+    AGENT 1 CASCADE: cheap tier first, full ensemble only when needed.
+    
+    Tier 1 (AGENT1_TIER1, e.g. gpt-4o-mini at low detail) answers clear-cut cases.
+    Errors, disagreement, low confidence or off-list answers escalate to the
+    Tier 2 ensemble. The tiers taken are recorded in `tier_path`.
+    """
+    if not AGENT1_CASCADE_ENABLED:
+        result = await agent1_openai_screener(
+            image_urls, crop_name, run_ensemble=True, tier=AGENT1_TIER2, candidate_diseases=candidate_diseases
+        )
+        result['tier_path'] = [f"{AGENT1_TIER2.name}:{AGENT1_TIER2.model}"]
+        result['escalation_reason'] = None
+        return result
+    
+    print(f"🪜 CASCADE: Tier 1 ({AGENT1_TIER1.model}, detail={AGENT1_TIER1.detail})")
+    tier1_results = await run_ensemble_members(
+        image_urls, crop_name, max(1, AGENT1_TIER1_VOTES), AGENT1_MEMBER_TIMEOUT_SECONDS, AGENT1_TIER1,
+        candidate_diseases,
+    )
+    tier_path = [f"{AGENT1_TIER1.name}:{AGENT1_TIER1.model}"]
+    reason = tier1_escalation_reason(tier1_results, crop_name)
+    
+    if reason is None:
+        if len(tier1_results) > 1:
+            result = tally_ensemble_votes(tier1_results, max(1, AGENT1_TIER1_VOTES))
+        else:
+            result = dict(tier1_results[0])
+            result['ensemble_calls'] = 1
+            result['all_predictions'] = [result['disease_name']]
+            result['prompt_usage'] = sum_prompt_usage(tier1_results)
+        print(f"   ✅ Tier 1 accepted: {result['disease_name']} ({result['confidence']:.0%})")
+        result['tier_path'] = tier_path
+        result['escalation_reason'] = None
+        return result
+    
+    print(f"   🔼 Escalating to Tier 2 ({AGENT1_TIER2.model}): {reason}")
+    result = await agent1_openai_screener(
+        image_urls, crop_name, run_ensemble=True, tier=AGENT1_TIER2, candidate_diseases=candidate_diseases
+    )
+    result['tier_path'] = tier_path + [f"{AGENT1_TIER2.name}:{AGENT1_TIER2.model}"]
+    result['escalation_reason'] = reason
+    result['tier1_predictions'] = [r['disease_name'] for r in tier1_results]
+    result['prompt_usage'] = sum_prompt_usage(tier1_results + [result])
+    return result
+
+
+async def verify_disease_strict(
     user_image_urls: List[str],
     reference_image_url: str,
     suspected_disease: str,
@@ -447,7 +1475,7 @@ def verify_disease_strict(
         # Download images
         image_parts = []
         for idx, url in enumerate(user_image_urls):
-            img_data = download_image_as_base64(url)
+            img_data = await download_image_as_base64(url)
             if img_data:
                 image_parts.append({
                     "mime_type": get_image_mime_type(url),
@@ -455,20 +1483,15 @@ def verify_disease_strict(
                 })
                 print(f"   📷 User image {idx + 1} loaded")
         
-        ref_data = download_image_as_base64(reference_image_url)
-        if not ref_data:
-            print(f"   ❌ Failed to download reference from: {reference_image_url}")
+        reference_part = await get_reference_image_part(suspected_disease)
+        if not reference_part:
+            print(f"   ❌ Failed to load reference from: {reference_image_url}")
             return {
                 "is_match": False,
                 "reasoning": "Reference image could not be downloaded from storage",
                 "confidence": 0.0,
                 "verdict": "FAILED - Reference Download Error"
             }
-        
-        reference_part = {
-            "mime_type": get_image_mime_type(reference_image_url),
-            "data": ref_data
-        }
         print(f"   📚 Reference image loaded")
         
         # SKEPTICAL VERIFICATION PROMPT - STRICT MATCHING
@@ -555,7 +1578,7 @@ Return ONLY valid JSON."""
         content_parts.append(reference_part)
         
         # Call Gemini
-        response = gemini_model.generate_content(content_parts)
+        response = await gemini_model.generate_content_async(content_parts)
         result_text = response.text.strip()
         
         # Clean JSON
@@ -620,7 +1643,7 @@ async def health_check(db: Session = Depends(get_db)):
     
     # Check database
     try:
-        db.execute(text("SELECT 1"))
+        await run_blocking(db.execute, text("SELECT 1"))
         health_status["database"] = "connected"
     except Exception as e:
         health_status["database"] = f"error: {str(e)}"
@@ -629,7 +1652,7 @@ async def health_check(db: Session = Depends(get_db)):
     # Check GCS
     try:
         bucket = storage_client.bucket(GCS_BUCKET_NAME)
-        bucket.exists()
+        await run_blocking(bucket.exists)
         health_status["storage"] = "connected"
     except Exception as e:
         health_status["storage"] = f"error: {str(e)}"
@@ -637,7 +1660,7 @@ async def health_check(db: Session = Depends(get_db)):
     
     # Check OpenAI
     try:
-        openai_client.models.list()
+        await openai_client.models.list()
         health_status["agent1_openai"] = "connected"
     except Exception as e:
         health_status["agent1_openai"] = f"error: {str(e)}"
@@ -658,6 +1681,7 @@ async def health_check(db: Session = Depends(get_db)):
 
 @app.post("/analyze", response_model=ConsultationResponse)
 async def analyze_crop(
+    response: Response,
     lat: float = Form(...),
     lon: float = Form(...),
     farmer_name: str = Form(...),
@@ -666,6 +1690,8 @@ async def analyze_crop(
     sown_date: Optional[str] = Form(None),
     observations: Optional[str] = Form(None),
     files: List[UploadFile] = File(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    prefer: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
     """
@@ -673,33 +1699,453 @@ async def analyze_crop(
     
     Stage 1: GPT-4o Visual Screening
     Stage 2: Gemini STRICT Skeptical Verification (90% threshold)
+    
+    With an `Idempotency-Key` header, a retry replays the first attempt's
+    outcome (or waits for it if still running) - no re-upload, no model calls.
+    
+    With `Prefer: respond-async` the request is queued and answered with
+    202 + job id; poll GET /jobs/{job_id} or GET /consultation/{session_id}.
+    """
+    validate_image_count(len(files))
+    raw_files = await read_uploads(files)
+    request = {
+        "lat": lat,
+        "lon": lon,
+        "farmer_name": farmer_name,
+        "village": village,
+        "crop_name": crop_name.value,
+        "sown_date": sown_date,
+        "observations": observations,
+    }
+    idempotency_key = idempotency_key.strip() if idempotency_key else None
+    fingerprint = idempotency_fingerprint(request, raw_files) if idempotency_key is not None else None
+    
+    if prefer and "respond-async" in prefer.lower():
+        if idempotency_key is not None:
+            validate_idempotency_key(idempotency_key)
+        try:
+            job, created = await run_blocking(
+                enqueue_job, db, request, raw_files, idempotency_key, fingerprint, IDEMPOTENCY_TTL_SECONDS
+            )
+        except IdempotencyKeyConflict:
+            raise idempotency_key_reused(idempotency_key)
+        if created:
+            job_wakeup.set()
+            print(f"📥 Queued analysis job {job['job_id']} (session {job['session_id']})")
+        return JSONResponse(
+            status_code=202,
+            content={
+                **job,
+                "status_url": f"/jobs/{job['job_id']}",
+                "consultation_url": f"/consultation/{job['session_id']}",
+            },
+            headers={"Location": f"/jobs/{job['job_id']}"},
+        )
+    
+    def start(session: Session):
+        return run_analysis(lat, lon, farmer_name, village, crop_name, sown_date, observations, raw_files, session)
+    
+    if idempotency_key is None:
+        return await start(db)
+    return await run_idempotent_analysis(idempotency_key, fingerprint, start, db, response)
+
+
+def validate_image_count(count: int):
+    if count < 1:
+        raise HTTPException(status_code=400, detail="Please upload at least 1 image")
+    if count > 3:
+        raise HTTPException(status_code=400, detail="Maximum 3 images allowed")
+
+
+def with_session(func, *args):
+    """Call a blocking app.jobs function with a short-lived session of its own."""
+    db = SessionLocal()
+    try:
+        return func(db, *args)
+    finally:
+        db.close()
+
+
+async def run_analysis_job(job: dict):
+    """Run one claimed job through run_analysis and record its outcome."""
+    request = job["request"]
+    db = SessionLocal()
+    try:
+        # A previous attempt may have saved the consultation before its worker died
+        if await run_blocking(fetch_consultation, db, uuid.UUID(job["session_id"])):
+            await run_blocking(finish_job, db, job["job_id"], JOB_SUCCEEDED)
+            return
+        try:
+            await run_analysis(
+                request["lat"], request["lon"], request["farmer_name"], request["village"],
+                CropEnum(request["crop_name"]), request.get("sown_date"), request.get("observations"),
+                job["raw_files"], db, session_id=job["session_id"],
+            )
+            await run_blocking(finish_job, db, job["job_id"], JOB_SUCCEEDED)
+        except HTTPException as e:
+            if e.status_code >= 500:
+                # Server-side failure (storage, provider): retry like any other error
+                await retry_or_fail_job(db, job, e.detail)
+                return
+            # Rejections (quality gate, invalid image, low confidence) are final outcomes
+            await run_blocking(
+                finish_job, db, job["job_id"], JOB_REJECTED,
+                {"status_code": e.status_code, "detail": e.detail},
+            )
+        except Exception as e:
+            await retry_or_fail_job(db, job, str(e))
+    finally:
+        db.close()
+
+
+async def retry_or_fail_job(db: Session, job: dict, error):
+    """Requeue a failed attempt, or mark the job failed once JOB_MAX_ATTEMPTS is reached."""
+    db.rollback()
+    if job["attempts"] < JOB_MAX_ATTEMPTS:
+        print(f"⚠️ Job {job['job_id']} attempt {job['attempts']} failed, requeueing: {error}")
+        await run_blocking(retry_job, db, job["job_id"], error)
+    else:
+        print(f"❌ Job {job['job_id']} failed after {job['attempts']} attempts: {error}")
+        await run_blocking(finish_job, db, job["job_id"], JOB_FAILED, error)
+
+
+async def migrate_chat_histories():
+    """One-off background copy of legacy chat_history arrays into chat_messages."""
+    try:
+        migrated = await run_blocking(with_session, migrate_legacy_histories)
+        if migrated:
+            print(f"💬 Migrated chat history of {migrated} consultations to chat_messages")
+    except Exception as e:
+        print(f"⚠️ Chat history migration failed (legacy reads still work): {e}")
+
+
+async def analysis_job_worker(worker_id: int):
+    """
+    Claim and run queued jobs one at a time. Sleeps until an enqueue wakes it
+    or JOB_POLL_INTERVAL_SECONDS passes (picks up jobs queued elsewhere).
+    Worker 0 also returns stale `running` jobs to the queue.
+    """
+    while True:
+        try:
+            if worker_id == 0:
+                requeued = await run_blocking(
+                    with_session, requeue_stale_jobs, JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS
+                )
+                if requeued:
+                    print(f"♻️ Requeued {requeued} stale analysis jobs")
+            job = await run_blocking(with_session, claim_next_job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Job worker {worker_id}: queue unavailable: {e}")
+            job = None
+        
+        if job is None:
+            job_wakeup.clear()
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), timeout=JOB_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        
+        print(f"🧵 Worker {worker_id}: running job {job['job_id']} (attempt {job['attempts']})")
+        job_worker_stats["busy"] += 1
+        started = time.perf_counter()
+        try:
+            await run_analysis_job(job)
+        finally:
+            job_worker_stats["busy"] -= 1
+            job_worker_stats["busy_seconds"] += time.perf_counter() - started
+            job_worker_stats["processed"] += 1
+
+
+def consultation_response(consultation: Consultation) -> ConsultationResponse:
+    return ConsultationResponse(
+        session_id=consultation.session_id,
+        created_at=consultation.created_at,
+        farmer_metadata=consultation.farmer_metadata,
+        crop_metadata=consultation.crop_metadata,
+        weather_context=consultation.weather_context,
+        ai_diagnosis_log=consultation.ai_diagnosis_log,
+        final_result=consultation.final_result,
+        image_urls=consultation.image_urls
+    )
+
+
+def idempotency_fingerprint(request: dict, raw_files: List[Tuple[str, bytes, Optional[str]]]) -> str:
+    """SHA-256 of the form fields plus the SHA-256 of every uploaded file (in order)."""
+    digest = hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8"))
+    for _, data, _ in raw_files:
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest()
+
+
+def idempotency_key_reused(key: str) -> HTTPException:
+    return HTTPException(
+        status_code=422,
+        detail={
+            "error": "idempotency_key_reused",
+            "message": f"Idempotency-Key {key} was already used for a different request",
+        },
+    )
+
+
+def record_idempotent_outcome(key: str, fingerprint: str, task: asyncio.Task):
+    """
+    Done-callback for an idempotent analysis: remember the session (or a
+    deterministic 4xx rejection) for replay. Server errors and cancellations
+    are not stored, so the client's retry runs the analysis again.
+    """
+    idempotent_analyses.pop(key, None)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is None:
+        idempotency_cache.set(key, {"session_id": str(task.result().session_id), "fingerprint": fingerprint})
+    elif isinstance(error, HTTPException) and 400 <= error.status_code < 500:
+        idempotency_cache.set(
+            key, {"status_code": error.status_code, "detail": error.detail, "fingerprint": fingerprint}
+        )
+
+
+async def replay_idempotent_outcome(outcome: dict, db: Session) -> Optional[ConsultationResponse]:
+    """Stored outcome as a response (or raised rejection). None if the consultation row is gone."""
+    if "status_code" in outcome:
+        raise HTTPException(
+            status_code=outcome["status_code"],
+            detail=outcome["detail"],
+            headers={"Idempotent-Replayed": "true"},
+        )
+    consultation = await run_blocking(fetch_consultation, db, uuid.UUID(outcome["session_id"]))
+    return consultation_response(consultation) if consultation else None
+
+
+def validate_idempotency_key(key: str):
+    if not key or len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency-Key must be 1-{IDEMPOTENCY_MAX_KEY_LENGTH} characters",
+        )
+
+
+async def run_with_own_session(start):
+    """Await `start(session)` with a session owned by this call."""
+    db = SessionLocal()
+    try:
+        return await start(db)
+    finally:
+        db.close()
+
+
+async def run_idempotent_analysis(
+    key: str, fingerprint: str, start, db: Session, response: Response
+) -> ConsultationResponse:
+    """
+    Run `start(session)` at most once per Idempotency-Key within IDEMPOTENCY_TTL_SECONDS.
+    A repeat with the same request fingerprint either replays the stored
+    outcome or attaches to the running task; a different request is a 422.
+    The task outlives the request that started it, so it gets its own session
+    instead of the request's `db` (closed when the request is torn down).
+    """
+    validate_idempotency_key(key)
+    
+    outcome = idempotency_cache.get(key)
+    if outcome is not CACHE_MISS:
+        if outcome["fingerprint"] != fingerprint:
+            raise idempotency_key_reused(key)
+        print(f"🔁 Idempotency-Key {key}: replaying stored outcome")
+        response.headers["Idempotent-Replayed"] = "true"
+        replayed = await replay_idempotent_outcome(outcome, db)
+        if replayed is not None:
+            return replayed
+        idempotency_cache.delete(key)
+    
+    in_flight = idempotent_analyses.get(key)
+    if in_flight is None:
+        task = asyncio.create_task(run_with_own_session(start))
+        idempotent_analyses[key] = (fingerprint, task)
+        task.add_done_callback(lambda t: record_idempotent_outcome(key, fingerprint, t))
+    else:
+        running_fingerprint, task = in_flight
+        if running_fingerprint != fingerprint:
+            raise idempotency_key_reused(key)
+        print(f"🔁 Idempotency-Key {key}: attaching to in-flight analysis")
+        response.headers["Idempotent-Replayed"] = "true"
+    # Shielded so a dropped connection doesn't cancel the analysis other retries are waiting on
+    return await asyncio.shield(task)
+
+
+@dataclass
+class ImageAnalysis:
+    """
+    The part of /analyze that depends only on the image bytes, crop and
+    location bucket - preprocessing, upload, local kNN and Agent 1 screening.
+    Coalesced requests share one instance; `session_id` is the session whose
+    folder holds the uploads.
+    """
+    session_id: str
+    preprocessing_report: dict
+    image_urls: List[str] = field(default_factory=list)
+    upload_timings: List[dict] = field(default_factory=list)
+    knn: dict = field(default_factory=dict)
+    agent1_result: Optional[dict] = None
+
+
+def analysis_flight_key(raw_files: List[Tuple[str, bytes, Optional[str]]], crop_name: str, lat: float, lon: float) -> str:
+    """Content hash of the uploaded bytes (in order) + crop + weather grid cell."""
+    digest = hashlib.sha256()
+    for _, data, _ in raw_files:
+        digest.update(hashlib.sha256(data).digest())
+    lat_cell, lon_cell = weather_grid_cell(lat, lon)
+    return f"{digest.hexdigest()}:{crop_name}:{lat_cell}:{lon_cell}"
+
+
+async def analyze_images(
+    raw_files: List[Tuple[str, bytes, Optional[str]]],
+    crop_name: str,
+    session_id: str,
+) -> ImageAnalysis:
+    """Preprocess, quality-gate, upload and screen one image set. Stops after the gate if it fails."""
+    # Normalize images (orientation, size, recompression, metadata) before anything else sees them
+    print(f"🖼️ Preprocessing {len(raw_files)} images...")
+    images, preprocessing_report = await preprocess_images(raw_files)
+    if not preprocessing_report["quality_gate"]["passed"]:
+        return ImageAnalysis(session_id=session_id, preprocessing_report=preprocessing_report)
+    
+    # Upload Images
+    print(f"📤 Uploading {len(images)} images (weather + location in parallel)...")
+    uploads = [upload_images(images, session_id)]
+    if IMAGE_ARCHIVE_ORIGINALS:
+        uploads.append(archive_originals(images, session_id))
+    upload_results = await asyncio.gather(*uploads)
+    image_urls, upload_timings = upload_results[0]
+    if IMAGE_ARCHIVE_ORIGINALS:
+        preprocessing_report["archived_originals"] = upload_results[1]
+    preprocessing_report["estimated_upload_seconds_saved"] = estimate_upload_seconds_saved(
+        preprocessing_report, upload_timings
+    )
+    print(f"✅ Images uploaded")
+    
+    # AGENT 1: GPT-4o Screening (ENSEMBLE MODE for 95%+ accuracy)
+    print(f"\n--- AGENT 1: Visual Screening (Enhanced Accuracy Mode) ---")
+    knn = await local_preclassify(images, crop_name)
+    if knn.get("suggestions"):
+        top = knn["suggestions"][0]
+        print(f"🧭 Local kNN: {top['disease']} ({top['similarity']:.2f}) in {knn['seconds'] * 1000:.0f}ms")
+    agent1_result = await screen_with_diagnosis_cache(images, crop_name, session_id, knn)
+    
+    return ImageAnalysis(
+        session_id=session_id,
+        preprocessing_report=preprocessing_report,
+        image_urls=image_urls,
+        upload_timings=upload_timings,
+        knn=knn,
+        agent1_result=agent1_result,
+    )
+
+
+async def run_coalesced_image_analysis(
+    raw_files: List[Tuple[str, bytes, Optional[str]]],
+    crop_name: str,
+    lat: float,
+    lon: float,
+    session_id: str,
+) -> Tuple[ImageAnalysis, bool]:
+    """
+    analyze_images() behind single-flight: a request whose bytes, crop and
+    grid cell match one already in flight awaits that run instead of starting
+    its own. Returns the analysis and whether it was shared.
+    """
+    if not ANALYSIS_COALESCING_ENABLED:
+        return await analyze_images(raw_files, crop_name, session_id), False
+    key = analysis_flight_key(raw_files, crop_name, lat, lon)
+    return await analysis_flights.run(key, lambda: analyze_images(raw_files, crop_name, session_id))
+
+
+async def run_analysis(
+    lat: float,
+    lon: float,
+    farmer_name: str,
+    village: str,
+    crop_name: CropEnum,
+    sown_date: Optional[str],
+    observations: Optional[str],
+    raw_files: List[Tuple[str, bytes, Optional[str]]],
+    db: Session,
+    session_id: Optional[str] = None,
+) -> ConsultationResponse:
+    """
+    The /analyze pipeline: preprocess, quality gate, upload, screen, persist.
+    `session_id` is pre-allocated for queued jobs; otherwise a new one is created.
     """
-    
-    # Validate files
-    if len(files) < 1:
-        raise HTTPException(status_code=400, detail="Please upload at least 1 image")
-    if len(files) > 3:
-        raise HTTPException(status_code=400, detail="Maximum 3 images allowed")
+    validate_image_count(len(raw_files))
     
     # Create Session
-    session_id = str(uuid.uuid4())
+    session_id = session_id or str(uuid.uuid4())
     print(f"\n{'='*60}")
     print(f"📋 New Consultation: {session_id}")
     print(f"{'='*60}")
     
-    # Upload Images
-    print(f"📤 Uploading {len(files)} images...")
-    image_urls = upload_images(files, session_id)
-    print(f"✅ Images uploaded")
+    # Weather and location lookups start now and overlap preprocessing + upload.
+    # Location is resolved once - shared by the low-confidence and success paths.
+    context_lookups = asyncio.gather(get_weather(lat, lon), get_location_name(lat, lon))
+    
+    core, coalesced = await run_coalesced_image_analysis(raw_files, crop_name.value, lat, lon, session_id)
+    preprocessing_report = core.preprocessing_report
+    if coalesced:
+        print(f"🔗 Coalesced with in-flight analysis {core.session_id}")
+    
+    # QUALITY GATE: hopeless photos are rejected before any upload or model call
+    if not preprocessing_report["quality_gate"]["passed"]:
+        context_lookups.cancel()
+        rejected = preprocessing_report["quality_gate"]["rejected_images"]
+        print(f"🚫 QUALITY GATE: rejecting {rejected}")
+        
+        consultation = Consultation(
+            session_id=session_id,
+            created_at=datetime.utcnow(),
+            farmer_metadata={
+                "name": farmer_name,
+                "village": village,
+                "coordinates": {"lat": lat, "lon": lon}
+            },
+            crop_metadata={
+                "crop_name": crop_name.value,
+                "sown_date": sown_date,
+                "observations": observations
+            },
+            ai_diagnosis_log={
+                "rejection_reason": "Local image quality gate",
+                "image_preprocessing": preprocessing_report
+            },
+            final_result={
+                "disease_name": "Low Quality - Need Clearer Images",
+                "confidence": 0,
+                "severity": "Unable to determine",
+                "message": "Photos are too blurry, dark, bright or small to analyze."
+            },
+            image_urls=[],
+            chat_history=[]
+        )
+        await run_blocking(save_consultation, db, consultation)
+        
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "error": "low_quality_image",
+                "message": "Unable to provide confident diagnosis. Please upload clearer images.",
+                "confidence": 0.0,
+                "threshold": 0.75,
+                "suggestion": "Try taking photos in better lighting, closer to the affected area, and ensure leaves are in focus.",
+                "quality_issues": rejected
+            }
+        )
     
-    # Get Weather
-    print(f"🌤️ Fetching weather...")
-    weather_summary = get_weather(lat, lon)
+    image_urls, upload_timings = core.image_urls, core.upload_timings
+    knn, agent1_result = core.knn, core.agent1_result
+    weather_summary, geocoded_location = await context_lookups
     print(f"✅ Weather: {weather_summary}")
     
-    # AGENT 1: GPT-4o Screening (ENSEMBLE MODE for 95%+ accuracy)
-    print(f"\n--- AGENT 1: Visual Screening (Enhanced Accuracy Mode) ---")
-    agent1_result = agent1_openai_screener(image_urls, crop_name.value, run_ensemble=True)
     suspected_disease = agent1_result.get("disease_name", "Unknown Disease")
     
     # IMMEDIATE REJECTION: Invalid images (not plant leaves)
@@ -723,8 +2169,6 @@ async def analyze_crop(
         print(f"   Rejecting diagnosis: {suspected_disease}")
         
         # Return low confidence result
-        db_session = next(get_db())
-        location_name = get_location_name(lat, lon)
         
         consultation = Consultation(
             session_id=session_id,
@@ -733,7 +2177,7 @@ async def analyze_crop(
                 "name": farmer_name,
                 "village": village,
                 "coordinates": {"lat": lat, "lon": lon},
-                "geocoded_village": location_name
+                "geocoded_village": geocoded_location
             },
             crop_metadata={
                 "crop_name": crop_name.value,
@@ -744,6 +2188,8 @@ async def analyze_crop(
             ai_diagnosis_log={
                 "agent1_result": agent1_result,
                 "rejection_reason": "Confidence below 75% threshold",
+                "upload_timings": upload_timings,
+                "image_preprocessing": preprocessing_report,
                 "accuracy_mode": "Enhanced (95%+ target)"
             },
             final_result={
@@ -756,9 +2202,7 @@ async def analyze_crop(
             chat_history=[]
         )
         
-        db_session.add(consultation)
-        db_session.commit()
-        db_session.close()
+        await run_blocking(save_consultation, db, consultation)
         
         raise HTTPException(
             status_code=422,
@@ -790,17 +2234,28 @@ async def analyze_crop(
     final_confidence = agent1_result.get("confidence", 0.5)
     
     # Bonus for ensemble consensus
-    if agent1_result.get('ensemble_votes') == '3/3':
+    if is_unanimous(agent1_result):
         final_confidence = min(final_confidence + 0.05, 0.99)
     
     print(f"✅ Final Diagnosis: {final_disease} (Confidence: {final_confidence:.0%})")
     
+    # Confident model diagnoses become extra labelled examples for the local kNN
+    if (
+        knn.get("vectors")
+        and not coalesced
+        and agent1_result.get("tier_path") != ["local_knn"]
+        and not agent1_result.get("served_from_cache")
+        and final_confidence >= EMBEDDING_LEARN_MIN_CONFIDENCE
+    ):
+        embedding_index.learn(final_disease, knn["vectors"])
+    
     # Build diagnosis log with accuracy enhancements
     ai_diagnosis_log = {
-        "agent1_model": "OpenAI GPT-4o (Ensemble Mode)",
+        "agent1_model": f"{agent1_result.get('agent', 'OpenAI GPT-4o')} (Cascade)",
         "accuracy_enhancements": {
             "deterministic_mode": "temperature=0",
             "ensemble_voting": agent1_result.get('ensemble_votes', 'N/A'),
+            "ensemble_mode": AGENT1_ENSEMBLE_MODE,
             "confidence_threshold": "75% minimum",
             "json_validation": "forced",
             "target_accuracy": "95%+"
@@ -809,6 +2264,24 @@ async def analyze_crop(
         "agent1_confidence": agent1_result.get("confidence"),
         "agent1_visual_symptoms": agent1_result.get("visual_symptoms"),
         "agent1_reasoning": agent1_result.get("preliminary_reasoning"),
+        "ensemble_votes": agent1_result.get("ensemble_votes"),
+        "ensemble_calls": agent1_result.get("ensemble_calls"),
+        "all_predictions": agent1_result.get("all_predictions", []),
+        "tier_path": agent1_result.get("tier_path", []),
+        "escalation_reason": agent1_result.get("escalation_reason"),
+        "agent1_prompt_usage": agent1_result.get("prompt_usage"),
+        "diagnosis_cache": {
+            "served_from_cache": agent1_result.get("served_from_cache", False),
+            "source_session": agent1_result.get("cache_source_session"),
+            "hamming_distance": agent1_result.get("cache_hamming_distance"),
+            "source_ensemble": agent1_result.get("cache_source_ensemble"),
+        },
+        "visual_match_score": knn.get("scores", {}).get(final_disease),
+        "coalesced_with": core.session_id if coalesced else None,
+        "local_knn": {
+            "suggestions": knn.get("suggestions", []),
+            "seconds": knn.get("seconds"),
+        },
         
         "agent2_model": "Google Gemini 2.5 Pro (STRICT Verifier)",
         "agent2_verification_approach": "Strict Visual Comparison with Reference Images",
@@ -828,6 +2301,8 @@ async def analyze_crop(
         "texture_analysis": agent1_result.get("visual_symptoms", ""),
         
         "weather_context": weather_summary,
+        "upload_timings": upload_timings,
+        "image_preprocessing": preprocessing_report,
         "final_confidence": final_confidence
     }
     
@@ -845,9 +2320,6 @@ async def analyze_crop(
     
     print(f"\n✅ Final Diagnosis: {final_disease} ({final_confidence:.0%})")
     
-    # Get geocoded location
-    geocoded_location = get_location_name(lat, lon)
-    
     farmer_metadata = {
         "name": farmer_name,
         "village": village,
@@ -873,22 +2345,135 @@ async def analyze_crop(
         image_urls=image_urls
     )
     
-    db.add(consultation)
-    db.commit()
-    db.refresh(consultation)
+    await run_blocking(save_consultation, db, consultation)
     
     print(f"✅ Consultation saved!")
     print(f"{'='*60}\n")
     
-    return ConsultationResponse(
-        session_id=consultation.session_id,
-        created_at=consultation.created_at,
-        farmer_metadata=consultation.farmer_metadata,
-        crop_metadata=consultation.crop_metadata,
-        weather_context=consultation.weather_context,
-        ai_diagnosis_log=consultation.ai_diagnosis_log,
-        final_result=consultation.final_result,
-        image_urls=consultation.image_urls
+    return consultation_response(consultation)
+
+
+def read_batch_archive(data: bytes) -> Tuple[Optional[str], Dict[str, Tuple[str, bytes, Optional[str]]]]:
+    """
+    Unpack an /analyze/batch ZIP: (manifest.json text if present, images by
+    path inside the archive). Blocking. Rejects archives that would expand
+    past BATCH_MAX_ARCHIVE_BYTES.
+    """
+    manifest = None
+    uploads = {}
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            members = [info for info in archive.infolist() if not info.is_dir()]
+            if sum(info.file_size for info in members) > BATCH_MAX_ARCHIVE_BYTES:
+                raise HTTPException(status_code=413, detail="Archive expands beyond the allowed size")
+            for info in members:
+                name = info.filename
+                if os.path.basename(name) == "manifest.json":
+                    manifest = archive.read(info).decode("utf-8")
+                    continue
+                uploads[name] = (os.path.basename(name), archive.read(info), mimetypes.guess_type(name)[0])
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="archive must be a ZIP file")
+    return manifest, uploads
+
+
+async def run_batch_item(index: int, item: BatchAnalysisItem, raw_files, semaphore: asyncio.Semaphore) -> dict:
+    """One batch consultation through run_analysis, as an NDJSON result record."""
+    result = {"index": index, "client_ref": item.client_ref}
+    async with semaphore:
+        db = SessionLocal()
+        try:
+            consultation = await run_analysis(
+                item.lat, item.lon, item.farmer_name, item.village, item.crop_name,
+                item.sown_date, item.observations, raw_files, db,
+            )
+            result.update(status="ok", status_code=200, consultation=jsonable_encoder(consultation))
+        except HTTPException as e:
+            result.update(status="rejected", status_code=e.status_code, error=e.detail)
+        except Exception as e:
+            print(f"❌ Batch item {index} failed: {e}")
+            result.update(status="error", status_code=500, error=str(e))
+        finally:
+            db.close()
+    return result
+
+
+async def stream_batch_results(items: List[BatchAnalysisItem], uploads: Dict[str, Tuple[str, bytes, Optional[str]]]):
+    """
+    Run every item with at most BATCH_CONCURRENCY in flight and yield one
+    NDJSON line per item as it finishes (completion order, not manifest
+    order), then a summary line. Unfinished items are cancelled if the
+    client goes away.
+    """
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks = [
+        asyncio.create_task(run_batch_item(index, item, [uploads[name] for name in item.files], semaphore))
+        for index, item in enumerate(items)
+    ]
+    outcomes = Counter()
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            outcomes[result["status"]] += 1
+            yield json.dumps(result) + "\n"
+        yield json.dumps({
+            "summary": {
+                "total": len(items),
+                "ok": outcomes["ok"],
+                "rejected": outcomes["rejected"],
+                "errors": outcomes["error"],
+                "seconds": round(time.perf_counter() - started, 2),
+            }
+        }) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    manifest: Optional[str] = Form(None),
+    files: List[UploadFile] = File(default=[]),
+    archive: Optional[UploadFile] = File(None),
+):
+    """
+    📦 Bulk analysis for field officers.
+    
+    `manifest` is a JSON list of BatchAnalysisItem; each item's `files` name
+    images sent as multipart `files` (matched by filename) or packed in a ZIP
+    `archive` (matched by path; the archive may carry manifest.json itself).
+    Items run through the normal /analyze pipeline, BATCH_CONCURRENCY at a
+    time, and results stream back as NDJSON as each one finishes.
+    """
+    uploads: Dict[str, Tuple[str, bytes, Optional[str]]] = {}
+    if archive is not None:
+        archive_manifest, uploads = await run_blocking(read_batch_archive, await archive.read())
+        manifest = manifest or archive_manifest
+    for name, data, content_type in await read_uploads(files):
+        if name in uploads:
+            raise HTTPException(status_code=400, detail=f"Duplicate filename in batch: {name}")
+        uploads[name] = (name, data, content_type)
+    
+    if not manifest:
+        raise HTTPException(status_code=400, detail="manifest is required (form field or manifest.json in the archive)")
+    try:
+        items = TypeAdapter(List[BatchAnalysisItem]).validate_json(manifest)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors(include_url=False)))
+    if not items:
+        raise HTTPException(status_code=400, detail="manifest has no items")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Maximum {BATCH_MAX_ITEMS} items per batch")
+    missing = sorted({name for item in items for name in item.files if name not in uploads})
+    if missing:
+        raise HTTPException(status_code=400, detail={"error": "missing_files", "files": missing})
+    
+    print(f"📦 Batch of {len(items)} consultations ({BATCH_CONCURRENCY} concurrent)")
+    return StreamingResponse(
+        stream_batch_results(items, uploads),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
     )
 
 
@@ -906,43 +2491,11 @@ class ChatResponse(BaseModel):
     session_id: str
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_live(
-    request: ChatRequest,
-    db: Session = Depends(get_db)
-):
+def build_chat_context(consultation: Consultation) -> dict:
     """
-    FIX 2: LIVE CHAT GENERATION
-    
-    CRITICAL: This endpoint calls Gemini 2.5 Pro on EVERY request.
-    NO STATIC RESPONSES. NO CACHING. LIVE GENERATION ONLY.
+    The per-session part of the chat prompt (diagnosis, verification,
+    weather, treatment), built once and cached in chat_context_cache.
     """
-    session_id = request.session_id
-    user_message = request.message.strip()
-    
-    print(f"\n{'='*50}")
-    print(f"💬 LIVE CHAT REQUEST")
-    print(f"   Session: {session_id}")
-    print(f"   Question: '{user_message}'")
-    print(f"{'='*50}")
-    
-    # Validate Gemini is available
-    if not gemini_chat_model:
-        raise HTTPException(status_code=503, detail="Chat service unavailable - Gemini not configured")
-    
-    # Fetch consultation
-    try:
-        consultation_uuid = uuid.UUID(session_id)
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid session ID format")
-    
-    consultation = db.query(Consultation).filter(
-        Consultation.session_id == consultation_uuid
-    ).first()
-    
-    if not consultation:
-        raise HTTPException(status_code=404, detail="Consultation not found")
-    
     # Extract context from consultation
     disease_name = consultation.final_result.get("disease_name", "Unknown") if consultation.final_result else "Unknown"
     
@@ -957,8 +2510,6 @@ async def chat_live(
     
     weather = consultation.weather_context or "Unknown"
     
-    chat_history = consultation.chat_history or []
-    
     # Get treatment plan if available
     treatment_plan = ""
     if consultation.final_result and consultation.final_result.get("treatment_plan"):
@@ -969,59 +2520,208 @@ async def chat_live(
             products = tp.get("recommended_products", [])
             treatment_plan = f"\nImmediate Actions: {', '.join(immediate)}\nPreventive: {', '.join(preventive)}"
     
+    confidence = consultation.final_result.get('confidence', 'N/A') if consultation.final_result else 'N/A'
+    context = f"""DIAGNOSIS CONTEXT:
+- Disease Identified: {disease_name}
+- Confidence: {confidence}%
+- Verification Reasoning: {verification_log}
+- Weather: {weather}
+{treatment_plan}"""
+    return {"disease_name": disease_name, "context": context}
+
+
+async def get_chat_context(db: Session, consultation_uuid: uuid.UUID) -> Optional[dict]:
+    """Cached chat context for a session; loads the consultation only on a miss. None if it doesn't exist."""
+    key = str(consultation_uuid)
+    context = chat_context_cache.get(key)
+    if context is not CACHE_MISS:
+        return context
+    
+    started = time.perf_counter()
+    consultation = await run_blocking(fetch_consultation, db, consultation_uuid)
+    chat_context_db_stats["fetches"] += 1
+    chat_context_db_stats["fetch_seconds"] += time.perf_counter() - started
+    if not consultation:
+        return None
+    context = build_chat_context(consultation)
+    chat_context_cache.set(key, context)
+    return context
+
+
+def chat_context_stats() -> dict:
+    """Cache counters plus the consultation-query time hits avoided (estimated from the miss average)."""
+    fetches = chat_context_db_stats["fetches"]
+    avg_fetch_seconds = chat_context_db_stats["fetch_seconds"] / fetches if fetches else 0.0
+    stats = chat_context_cache.stats()
+    return {
+        **stats,
+        "db_fetches": fetches,
+        "avg_fetch_ms": round(avg_fetch_seconds * 1000, 2),
+        "estimated_db_seconds_saved": round(stats["hits"] * avg_fetch_seconds, 3),
+    }
+
+
+def build_chat_prompt(context: dict, summary: Optional[str], chat_history: List[dict], user_message: str) -> str:
+    """
+    Gemini prompt for one chat turn: the cached diagnosis context, the
+    rolling summary of older turns, recent history (`chat_history` is the
+    tail from the chat store, starting right after the summary) and the
+    farmer's question.
+    """
     # Format recent chat history for context
     history_context = ""
+    if summary:
+        history_context = f"\n\nEARLIER CONVERSATION (summary):\n{summary}"
     if len(chat_history) > 0:
-        recent = chat_history[-4:]  # Last 2 Q&A pairs
-        history_context = "\n\nRECENT CONVERSATION:\n"
-        for msg in recent:
+        history_context += "\n\nRECENT CONVERSATION:\n"
+        for msg in chat_history:
             role = "User" if msg.get("role") == "user" else "You"
             history_context += f"{role}: {msg.get('content', '')}\n"
     
-    print(f"   Disease: {disease_name}")
-    print(f"   User question: '{user_message}'")
-    print(f"   Chat history: {len(chat_history)} messages")
+    print(f"   Disease: {context['disease_name']}")
+    print(f"   Chat history window: {len(chat_history)} messages{' + summary' if summary else ''}")
     
-    # Construct LIVE prompt with full context
-    prompt = f"""You are an expert agricultural AI assistant helping a farmer.
-
-DIAGNOSIS CONTEXT:
-- Disease Identified: {disease_name}
-- Confidence: {consultation.final_result.get('confidence', 'N/A')}%
-- Verification Reasoning: {verification_log}
-- Weather: {weather}
-{treatment_plan}
+    # Per-session context first (stable across the session's turns), the
+    # changing history next, the question last
+    prompt = f"""{context['context']}
 {history_context}
 
 FARMER'S CURRENT QUESTION: "{user_message}"
 
-CRITICAL INSTRUCTIONS:
-1. READ THE QUESTION CAREFULLY - answer what the farmer is actually asking
-2. If they ask "why" → explain the specific symptoms you observed
-3. If they ask "what treatment" → list specific actions and products
-4. If they ask "how to prevent" → give preventive measures
-5. If they ask "okay" or acknowledge → briefly confirm and ask if they need more help
-6. Keep answers FOCUSED and CONCISE (2-4 sentences max)
-7. Use simple, practical language a farmer can understand
+Your answer:"""
+    return prompt
 
-ANSWER THE QUESTION DIRECTLY - DO NOT give generic responses.
 
-Your answer:"""
+def record_chat_usage(prompt: str, usage) -> dict:
+    """Log and accumulate prompt size and cached-token counts from a Gemini response's usage_metadata."""
+    usage_log = {
+        "prompt_chars": len(prompt),
+        "prompt_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+        "cached_tokens": getattr(usage, "cached_content_token_count", 0) or 0,
+        "output_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+    }
+    chat_prompt_stats["turns"] += 1
+    for key, value in usage_log.items():
+        chat_prompt_stats[key] += value
+    print(f"   📊 Prompt: {usage_log['prompt_chars']} chars, {usage_log['prompt_tokens']} tokens "
+          f"({usage_log['cached_tokens']} cached), output {usage_log['output_tokens']} tokens")
+    return usage_log
+
+
+def chat_prompt_usage_stats() -> dict:
+    turns = chat_prompt_stats["turns"]
+    prompt_tokens = chat_prompt_stats["prompt_tokens"]
+    return {
+        **chat_prompt_stats,
+        "avg_prompt_tokens": round(prompt_tokens / turns, 1) if turns else 0.0,
+        "cached_token_ratio": round(chat_prompt_stats["cached_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0,
+    }
+
+
+async def refresh_chat_summary(session_uuid: uuid.UUID, last_seq: int):
+    """
+    Fold messages that have slid out of the prompt window into the session's
+    rolling summary, once at least CHAT_SUMMARY_REFRESH_EVERY of them are
+    uncovered. The previous summary plus only the new messages go to Gemini,
+    so each refresh costs the same however long the conversation gets.
+    """
+    through_seq = last_seq - CHAT_HISTORY_WINDOW
+    current = await run_blocking(with_session, get_summary, session_uuid)
+    covered_seq = current["through_seq"] if current else 0
+    if through_seq - covered_seq < CHAT_SUMMARY_REFRESH_EVERY:
+        return
+    
+    new_messages = await run_blocking(with_session, messages_between, session_uuid, covered_seq, through_seq)
+    if not new_messages:
+        return
+    transcript = "\n".join(
+        f"{'Farmer' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in new_messages
+    )
+    prompt = f"""You maintain a running summary of a conversation between a farmer and an agricultural assistant about a crop disease diagnosis.
+
+PREVIOUS SUMMARY:
+{current["summary"] if current else "(none yet)"}
+
+NEW MESSAGES:
+{transcript}
+
+Rewrite the summary to include the new messages. Keep the farmer's situation, what they asked, the advice and products already given, and any open concerns. Plain text, at most {CHAT_SUMMARY_MAX_WORDS} words.
+
+Updated summary:"""
+    
+    started = time.perf_counter()
+    response = await gemini_summary_model.generate_content_async(prompt)
+    summary = response.text.strip()
+    await run_blocking(with_session, save_summary, session_uuid, summary, through_seq)
+    print(f"   🧾 Chat summary for {session_uuid} now covers {through_seq} messages "
+          f"({time.perf_counter() - started:.1f}s)")
+
+
+def schedule_chat_summary(session_uuid: uuid.UUID, last_seq: int):
+    """Start a background summary refresh for a long conversation (at most one per session at a time)."""
+    if not CHAT_SUMMARY_ENABLED or not gemini_summary_model or last_seq < CHAT_SUMMARY_THRESHOLD:
+        return
+    
+    async def run():
+        try:
+            await chat_summary_flights.run(str(session_uuid), lambda: refresh_chat_summary(session_uuid, last_seq))
+        except Exception as e:
+            print(f"   ⚠️ Chat summary refresh failed for {session_uuid}: {e}")
+    
+    task = asyncio.create_task(run())
+    chat_summary_tasks.add(task)
+    task.add_done_callback(chat_summary_tasks.discard)
+
+
+def append_chat_turn(db: Session, session_id: uuid.UUID, user_message: str, answer: str) -> int:
+    """Append a question/answer pair to the chat store. Blocking. Returns the history length."""
+    return append_messages(db, session_id, [("user", user_message), ("assistant", answer)])
 
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_live(
+    request: ChatRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    FIX 2: LIVE CHAT GENERATION
+    
+    CRITICAL: This endpoint calls Gemini 2.5 Pro on EVERY request.
+    NO STATIC RESPONSES. NO CACHING. LIVE GENERATION ONLY.
+    """
+    session_id = request.session_id
+    user_message = request.message.strip()
+    
+    print(f"\n{'='*50}")
+    print(f"💬 LIVE CHAT REQUEST")
+    print(f"   Session: {session_id}")
+    print(f"   Question: '{user_message}'")
+    print(f"{'='*50}")
+    
+    # Validate Gemini is available
+    if not gemini_chat_model:
+        raise HTTPException(status_code=503, detail="Chat service unavailable - Gemini not configured")
+    
+    # Fetch consultation
+    try:
+        consultation_uuid = uuid.UUID(session_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid session ID format")
+    
+    context = await get_chat_context(db, consultation_uuid)
+    
+    if not context:
+        raise HTTPException(status_code=404, detail="Consultation not found")
+    
+    summary, chat_history = await run_blocking(prompt_history, db, consultation_uuid, CHAT_HISTORY_WINDOW)
+    prompt = build_chat_prompt(context, summary, chat_history, user_message)
+    
     print(f"   📤 Calling Gemini 2.5 Pro LIVE...")
     
-    # CRITICAL: LIVE GENERATION - Create fresh model instance
     try:
-        live_gemini = genai.GenerativeModel(
-            'gemini-2.5-pro',
-            generation_config={
-                'temperature': 0.3,  # Some creativity but still focused
-                'top_p': 0.8,
-                'top_k': 40
-            }
-        )
-        response = live_gemini.generate_content(prompt)
+        response = await gemini_chat_model.generate_content_async(prompt)
         generated_answer = response.text.strip()
+        record_chat_usage(prompt, getattr(response, "usage_metadata", None))
         
         print(f"   📥 Generated: {generated_answer[:100]}...")
         
@@ -1031,18 +2731,13 @@ Your answer:"""
     
     # Save to database
     try:
-        new_history = list(chat_history)
-        new_history.append({"role": "user", "content": user_message})
-        new_history.append({"role": "assistant", "content": generated_answer})
-        
-        consultation.chat_history = new_history
-        db.commit()
-        
-        print(f"   💾 Saved (History: {len(new_history)} messages)")
+        history_length = await run_blocking(append_chat_turn, db, consultation_uuid, user_message, generated_answer)
+        print(f"   💾 Saved (History: {history_length} messages)")
+        schedule_chat_summary(consultation_uuid, history_length)
         
     except Exception as e:
         print(f"   ⚠️ DB save error: {str(e)}")
-        db.rollback()
+        await run_blocking(db.rollback)
     
     print(f"   ✅ Returning LIVE response")
     print(f"{'='*50}\n")
@@ -1053,6 +2748,99 @@ Your answer:"""
     )
 
 
+def sse_event(event: str, data: dict) -> str:
+    """One Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_chat_answer(session_id: str, consultation_uuid: uuid.UUID, user_message: str, prompt: str):
+    """
+    SSE body for /chat/stream: `delta` events carry Gemini's chunks as they
+    arrive, then `done` with the full answer once the turn is saved (or
+    `error`). The turn is persisted only when generation completes; if the
+    client disconnects first, the Gemini stream is dropped and nothing is saved.
+    """
+    started = time.perf_counter()
+    parts = []
+    first_token_seconds = None
+    try:
+        response = await gemini_chat_model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk without text parts (e.g. a finish/safety marker)
+                continue
+            if not text:
+                continue
+            if first_token_seconds is None:
+                first_token_seconds = time.perf_counter() - started
+                print(f"   ⚡ First token after {first_token_seconds:.2f}s")
+            parts.append(text)
+            yield sse_event("delta", {"text": text})
+        record_chat_usage(prompt, getattr(response, "usage_metadata", None))
+    except asyncio.CancelledError:
+        print(f"   🔌 Client disconnected mid-stream - turn not saved ({session_id})")
+        raise
+    except Exception as e:
+        print(f"   ❌ Gemini Error: {str(e)}")
+        yield sse_event("error", {"detail": f"Chat generation failed: {str(e)}"})
+        return
+    
+    generated_answer = "".join(parts).strip()
+    try:
+        history_length = await run_blocking(
+            with_session, append_chat_turn, consultation_uuid, user_message, generated_answer
+        )
+        print(f"   💾 Saved (History: {history_length} messages)")
+        schedule_chat_summary(consultation_uuid, history_length)
+    except Exception as e:
+        print(f"   ⚠️ DB save error: {str(e)}")
+    
+    yield sse_event("done", {
+        "response": generated_answer,
+        "session_id": session_id,
+        "first_token_seconds": round(first_token_seconds, 3) if first_token_seconds is not None else None,
+        "total_seconds": round(time.perf_counter() - started, 3),
+    })
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Streaming variant of /chat over Server-Sent Events (text/event-stream).
+    Same prompt and persistence as /chat; tokens are forwarded as Gemini
+    produces them.
+    """
+    session_id = request.session_id
+    user_message = request.message.strip()
+    
+    print(f"\n💬 STREAMING CHAT REQUEST - Session: {session_id}")
+    
+    if not gemini_chat_model:
+        raise HTTPException(status_code=503, detail="Chat service unavailable - Gemini not configured")
+    
+    try:
+        consultation_uuid = uuid.UUID(session_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid session ID format")
+    
+    context = await get_chat_context(db, consultation_uuid)
+    if not context:
+        raise HTTPException(status_code=404, detail="Consultation not found")
+    
+    summary, chat_history = await run_blocking(prompt_history, db, consultation_uuid, CHAT_HISTORY_WINDOW)
+    prompt = build_chat_prompt(context, summary, chat_history, user_message)
+    return StreamingResponse(
+        stream_chat_answer(session_id, consultation_uuid, user_message, prompt),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/consultation/{session_id}", response_model=ConsultationResponse)
 async def get_consultation(session_id: str, db: Session = Depends(get_db)):
     """Retrieve a consultation by session ID."""
@@ -1061,23 +2849,55 @@ async def get_consultation(session_id: str, db: Session = Depends(get_db)):
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid session ID format")
     
-    consultation = db.query(Consultation).filter(
-        Consultation.session_id == consultation_uuid
-    ).first()
+    consultation = await run_blocking(fetch_consultation, db, consultation_uuid)
     
     if not consultation:
+        # Queued/running async analysis: report progress instead of 404
+        job = await run_blocking(get_job_for_session, db, consultation_uuid)
+        if job and job["status"] not in (JOB_SUCCEEDED, JOB_REJECTED, JOB_FAILED):
+            return JSONResponse(status_code=202, content=job)
+        if job and job["status"] == JOB_FAILED:
+            raise HTTPException(status_code=500, detail={"error": "analysis_failed", "job": job})
+        if job and job["status"] == JOB_REJECTED:
+            # Replay the stored rejection (quality gate, invalid image, low confidence)
+            rejection = job["error"] if isinstance(job["error"], dict) else {}
+            raise HTTPException(
+                status_code=rejection.get("status_code", 422),
+                detail=rejection.get("detail", job["error"]),
+            )
         raise HTTPException(status_code=404, detail="Consultation not found")
     
-    return ConsultationResponse(
-        session_id=consultation.session_id,
-        created_at=consultation.created_at,
-        farmer_metadata=consultation.farmer_metadata,
-        crop_metadata=consultation.crop_metadata,
-        weather_context=consultation.weather_context,
-        ai_diagnosis_log=consultation.ai_diagnosis_log,
-        final_result=consultation.final_result,
-        image_urls=consultation.image_urls
-    )
+    return consultation_response(consultation)
+
+
+@app.get("/jobs/stats")
+async def job_queue_stats(db: Session = Depends(get_db)):
+    """Queue depth per status and worker-pool utilization for async analyses."""
+    stats = await run_blocking(queue_stats, db)
+    started_at = job_worker_stats["started_at"]
+    capacity_seconds = (time.time() - started_at) * JOB_WORKERS if started_at else 0.0
+    stats["workers"] = {
+        "size": JOB_WORKERS,
+        "busy": job_worker_stats["busy"],
+        "processed": job_worker_stats["processed"],
+        "utilization": round(job_worker_stats["busy_seconds"] / capacity_seconds, 4) if capacity_seconds else 0.0,
+    }
+    return stats
+
+
+@app.get("/jobs/{job_id}")
+async def get_analysis_job(job_id: str, db: Session = Depends(get_db)):
+    """Status of an asynchronous /analyze job."""
+    try:
+        job_uuid = uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid job ID format")
+    
+    job = await run_blocking(get_job, db, job_uuid)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job["consultation_url"] = f"/consultation/{job['session_id']}"
+    return job
 
 
 @app.get("/diseases")
@@ -1090,6 +2910,37 @@ async def list_diseases():
     }
 
 
+@app.post("/references/refresh")
+async def refresh_references():
+    """Invalidate and rebuild the reference image index (e.g. after uploading new refs)."""
+    reference_index.invalidate()
+    await rebuild_reference_index()
+    return reference_index.stats()
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for the in-process caches."""
+    return {
+        "weather": weather_cache.stats(),
+        "geocode": geocode_cache.stats(),
+        "reference_index": reference_index.stats(),
+        "reference_images": reference_image_cache.stats(),
+        "diagnosis": diagnosis_cache.stats(),
+        "embedding": embedding_index.stats(),
+        "analysis_coalescing": analysis_flights.stats(),
+        "chat_context": chat_context_stats(),
+        "chat_summary": chat_summary_flights.stats(),
+        "chat_prompt": chat_prompt_usage_stats(),
+        "agent1_prompt": {
+            **agent1_prompt_stats,
+            "cached_ratio": round(agent1_prompt_stats["cached_tokens"] / agent1_prompt_stats["prompt_tokens"], 4)
+            if agent1_prompt_stats["prompt_tokens"] else 0.0,
+        },
+        "idempotency": {**idempotency_cache.stats(), "in_flight": len(idempotent_analyses)},
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,128 @@
+"""
+Agent 1 cascade against two local OpenAI-compatible stand-ins wired in through
+AGENT1_TIER1_BASE_URL / AGENT1_TIER2_BASE_URL: tier 1 settles clear-cut
+answers, every escalation reason hands over to the tier 2 ensemble.
+"""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from conftest import main
+
+IMAGE_URLS = ["data:image/jpeg;base64,/9j/"]
+
+
+def verdict(disease_name: str, confidence: float) -> dict:
+    return {
+        "disease_name": disease_name,
+        "confidence": confidence,
+        "visual_symptoms": "lesions on the upper leaf surface",
+        "preliminary_reasoning": "lesion shape and colour",
+    }
+
+
+class ChatCompletionsStandIn(BaseHTTPRequestHandler):
+    """Answers /chat/completions with the server's scripted replies, in order (the last one repeats)."""
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.models.append(request["model"])
+            reply = server.replies[min(len(server.models), len(server.replies)) - 1]
+        if isinstance(reply, int):
+            self.respond(reply, {"error": {"message": "stand-in failure", "type": "invalid_request_error"}})
+            return
+        self.respond(200, {
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": request["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(reply)},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+        })
+
+    def respond(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def tiers(monkeypatch):
+    """Start both stand-ins; `configure(tier1_replies, tier2_replies)` points the cascade at them."""
+    servers = {}
+    for name in ("tier1", "tier2"):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), ChatCompletionsStandIn)
+        server.lock = threading.Lock()
+        server.models = []
+        server.replies = [verdict("Apple Scab", 0.95)]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[name] = server
+        monkeypatch.setenv(f"AGENT1_{name.upper()}_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+
+    monkeypatch.setattr(main, "AGENT1_CASCADE_ENABLED", True)
+    monkeypatch.setattr(main, "AGENT1_TIER1_ACCEPT_CONFIDENCE", 0.9)
+    monkeypatch.setattr(main, "AGENT1_ESCALATE_OFF_LIST", True)
+
+    def configure(tier1_replies, tier2_replies=(verdict("Apple Scab", 0.9),), tier1_votes=1):
+        servers["tier1"].replies = list(tier1_replies)
+        servers["tier2"].replies = list(tier2_replies)
+        monkeypatch.setattr(main, "AGENT1_TIER1_VOTES", tier1_votes)
+        monkeypatch.setattr(main, "AGENT1_TIER1", main.build_screener_tier("tier1", "AGENT1_TIER1", "tier1-model", "low"))
+        monkeypatch.setattr(main, "AGENT1_TIER2", main.build_screener_tier("tier2", "AGENT1_TIER2", "tier2-model", "high"))
+        return servers["tier1"].models, servers["tier2"].models
+
+    yield configure
+    for server in servers.values():
+        server.shutdown()
+        server.server_close()
+
+
+def screen() -> dict:
+    return asyncio.run(main.agent1_cascade_screener(IMAGE_URLS, "Apple"))
+
+
+def test_tier1_accepts_clear_cut_answer(tiers):
+    tier1_calls, tier2_calls = tiers([verdict("Apple Scab", 0.95)])
+
+    result = screen()
+
+    assert result["disease_name"] == "Apple Scab"
+    assert result["tier_path"] == ["tier1:tier1-model"]
+    assert result["escalation_reason"] is None
+    assert result["ensemble_calls"] == 1
+    assert tier1_calls == ["tier1-model"]
+    assert tier2_calls == []
+
+
+@pytest.mark.parametrize("reason, tier1_replies, tier1_votes", [
+    ("tier1_error", [400], 1),
+    ("tier1_disputed", [verdict("Apple Scab", 0.95), verdict("Black Rot", 0.95)], 2),
+    ("tier1_low_confidence", [verdict("Apple Scab", 0.6)], 1),
+    ("tier1_off_list", [verdict("Late Blight", 0.97)], 1),
+])
+def test_tier1_escalates_to_tier2(tiers, reason, tier1_replies, tier1_votes):
+    tier1_calls, tier2_calls = tiers(tier1_replies, [verdict("Black Rot", 0.88)], tier1_votes=tier1_votes)
+
+    result = screen()
+
+    assert result["escalation_reason"] == reason
+    assert result["tier_path"] == ["tier1:tier1-model", "tier2:tier2-model"]
+    assert result["disease_name"] == "Black Rot"
+    assert tier1_calls == ["tier1-model"] * tier1_votes
+    assert tier2_calls == ["tier2-model"] * main.AGENT1_ENSEMBLE_SIZE
@@ -0,0 +1,45 @@
+"""
+Request coalescing: concurrent identical /analyze submissions share one
+image analysis but each still gets its own consultation.
+"""
+
+import asyncio
+
+from conftest import analysis_request, leaf_jpeg, main
+
+CONCURRENT_REQUESTS = 5
+
+
+def test_identical_analyses_share_one_run(providers, monkeypatch):
+    runs = []
+    analyze_images = main.analyze_images
+
+    async def counted_analyze_images(raw_files, crop_name, session_id):
+        runs.append(session_id)
+        return await analyze_images(raw_files, crop_name, session_id)
+
+    monkeypatch.setattr(main, "analyze_images", counted_analyze_images)
+    raw_files = [("leaf.jpg", leaf_jpeg(seed=42), "image/jpeg")]
+
+    async def submit():
+        return await asyncio.gather(*(
+            main.run_analysis(**analysis_request(raw_files, farmer_name=f"Farmer {i}"))
+            for i in range(CONCURRENT_REQUESTS)
+        ))
+
+    results = asyncio.run(submit())
+
+    assert len(runs) == 1
+    assert len(providers.uploads) == len(raw_files)
+    assert providers.model_calls == main.AGENT1_ENSEMBLE_SIZE
+
+    leader_session = runs[0]
+    assert len({str(r.session_id) for r in results}) == CONCURRENT_REQUESTS
+    assert len(providers.saved) == CONCURRENT_REQUESTS
+    coalesced_with = {
+        str(c.session_id): c.ai_diagnosis_log["coalesced_with"] for c in providers.saved
+    }
+    assert coalesced_with.pop(leader_session) is None
+    assert set(coalesced_with.values()) == {leader_session}
+    assert all(c.image_urls for c in providers.saved)
+    assert main.analysis_flights.stats()["in_flight"] == 0
@@ -0,0 +1,34 @@
+"""
+/analyze concurrency: with the provider calls off the event loop, N
+different consultations take about as long as one, not N times as long.
+"""
+
+import asyncio
+import time
+
+from conftest import analysis_request, leaf_jpeg, main
+
+CONCURRENT_REQUESTS = 8
+
+
+async def timed_analyses(raw_file_sets):
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        main.run_analysis(**analysis_request(raw_files)) for raw_files in raw_file_sets
+    ))
+    return results, time.perf_counter() - started
+
+
+def test_distinct_analyses_overlap(providers):
+    image_sets = [[(f"leaf_{i}.jpg", leaf_jpeg(seed=i), "image/jpeg")] for i in range(CONCURRENT_REQUESTS + 1)]
+
+    _, single_seconds = asyncio.run(timed_analyses(image_sets[:1]))
+    results, concurrent_seconds = asyncio.run(timed_analyses(image_sets[1:]))
+
+    assert len(results) == CONCURRENT_REQUESTS
+    assert len(providers.saved) == CONCURRENT_REQUESTS + 1
+    assert len(providers.uploads) == CONCURRENT_REQUESTS + 1
+    # Serialized they would take CONCURRENT_REQUESTS x single; allow generous overhead
+    assert concurrent_seconds < single_seconds * CONCURRENT_REQUESTS / 3, (
+        f"1 request: {single_seconds:.2f}s, {CONCURRENT_REQUESTS} concurrent: {concurrent_seconds:.2f}s"
+    )
@@ -0,0 +1,45 @@
+"""
+Legacy chat_history entries are coerced to what the chat_messages columns
+accept before they are migrated or put into a prompt.
+"""
+
+from app.chat_store import legacy_history
+
+
+class FakeQuery:
+    def __init__(self, value):
+        self.value = value
+
+    def filter(self, *criteria):
+        return self
+
+    def scalar(self):
+        return self.value
+
+
+class FakeSession:
+    def __init__(self, chat_history):
+        self.chat_history = chat_history
+
+    def query(self, *columns):
+        return FakeQuery(self.chat_history)
+
+
+def test_legacy_history_coerces_role_and_content():
+    db = FakeSession([
+        {"role": "user", "content": "Why are the leaves spotted?"},
+        {"role": "assistant", "content": None},
+        {"content": 42},
+        "bare string",
+    ])
+
+    assert legacy_history(db, session_id=None) == [
+        {"role": "user", "content": "Why are the leaves spotted?"},
+        {"role": "assistant", "content": ""},
+        {"role": "user", "content": "42"},
+        {"role": "user", "content": "bare string"},
+    ]
+
+
+def test_legacy_history_without_history():
+    assert legacy_history(FakeSession(None), session_id=None) == []
@@ -0,0 +1,31 @@
+"""
+Diagnosis cache hits reuse an earlier verdict without reporting the earlier
+session's model calls as this request's.
+"""
+
+import asyncio
+
+from app.diagnosis_cache import DiagnosisCache
+from conftest import analysis_request, leaf_jpeg, main
+
+
+def test_cache_hit_reports_no_model_calls(providers, monkeypatch):
+    monkeypatch.setattr(main, "DIAGNOSIS_CACHE_ENABLED", True)
+    monkeypatch.setattr(main, "diagnosis_cache", DiagnosisCache(max_entries=10, ttl_seconds=60, max_distance=6))
+    raw_files = [("leaf.jpg", leaf_jpeg(seed=7), "image/jpeg")]
+
+    asyncio.run(main.run_analysis(**analysis_request(raw_files)))
+    calls_after_first = providers.model_calls
+    asyncio.run(main.run_analysis(**analysis_request(raw_files)))
+
+    first, second = (c.ai_diagnosis_log for c in providers.saved)
+    assert calls_after_first == main.AGENT1_ENSEMBLE_SIZE
+    assert providers.model_calls == calls_after_first
+    assert first["ensemble_calls"] == main.AGENT1_ENSEMBLE_SIZE
+    assert second["diagnosis_cache"]["served_from_cache"]
+    assert second["ensemble_calls"] == 0
+    assert second["ensemble_votes"] is None
+    assert second["tier_path"] == ["diagnosis_cache"]
+    assert second["all_predictions"] == [second["agent1_prediction"]]
+    assert second["diagnosis_cache"]["source_ensemble"]["ensemble_calls"] == main.AGENT1_ENSEMBLE_SIZE
+    assert second["diagnosis_cache"]["source_ensemble"]["all_predictions"] == first["all_predictions"]
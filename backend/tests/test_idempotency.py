@@ -0,0 +1,75 @@
+"""
+Idempotency-Key handling for /analyze: one run per key and request
+fingerprint, on a session the running task owns.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException, Response
+
+from conftest import main
+
+CONSULTATION = SimpleNamespace(session_id="7a1c3e0e-0000-4000-8000-000000000001")
+
+
+class FakeSession:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    created = []
+
+    def session_factory():
+        created.append(FakeSession())
+        return created[-1]
+
+    monkeypatch.setattr(main, "SessionLocal", session_factory)
+    monkeypatch.setattr(main, "idempotent_analyses", {})
+    monkeypatch.setattr(main.idempotency_cache, "_entries", type(main.idempotency_cache._entries)())
+    return created
+
+
+def test_task_runs_on_its_own_session(sessions):
+    request_db = FakeSession()
+    used = []
+
+    async def start(session):
+        used.append(session)
+        await asyncio.sleep(0.01)
+        return CONSULTATION
+
+    result = asyncio.run(main.run_idempotent_analysis("key-1", "fp-a", start, request_db, Response()))
+
+    assert result is CONSULTATION
+    assert used == sessions and used[0] is not request_db
+    assert sessions[0].closed
+
+
+def test_key_reused_for_other_request_is_rejected(sessions):
+    runs = []
+
+    async def start(session):
+        runs.append(session)
+        await asyncio.sleep(0.05)
+        return CONSULTATION
+
+    async def submit():
+        first = asyncio.ensure_future(main.run_idempotent_analysis("key-2", "fp-a", start, None, Response()))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as in_flight:
+            await main.run_idempotent_analysis("key-2", "fp-b", start, None, Response())
+        same = await main.run_idempotent_analysis("key-2", "fp-a", start, None, Response())
+        return in_flight.value, same, await first
+
+    in_flight, same, first = asyncio.run(submit())
+
+    assert in_flight.status_code == 422
+    assert same is first is CONSULTATION
+    assert len(runs) == 1
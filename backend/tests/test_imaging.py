@@ -0,0 +1,59 @@
+"""
+Upload normalization: metadata is always stripped, and bytes that cannot be
+re-encoded are rejected instead of being stored or sent to the model.
+"""
+
+import asyncio
+import io
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from app.imaging import UndecodableImageError, normalize_image
+from conftest import analysis_request, leaf_jpeg, main
+
+
+def test_normalize_strips_exif():
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"  # Make
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(leaf_jpeg(seed=1))).save(buffer, format="JPEG", exif=exif)
+
+    image = normalize_image("leaf.jpg", buffer.getvalue(), "image/jpeg", max_edge=256)
+
+    assert not Image.open(io.BytesIO(image.data)).getexif()
+    assert image.content_type == "image/jpeg"
+
+
+def test_normalize_rejects_undecodable_bytes():
+    with pytest.raises(UndecodableImageError):
+        normalize_image("leaf.heic", b"\x00\x00\x00\x18ftypheic" + b"\x00" * 64, "image/heic", max_edge=256)
+
+
+@pytest.mark.parametrize("output_format, content_type, extension, pillow_format", [
+    ("JPEG", "image/jpeg", "jpg", "JPEG"),
+    ("webp", "image/webp", "webp", "WEBP"),
+])
+def test_normalize_labels_match_encoded_format(output_format, content_type, extension, pillow_format):
+    image = normalize_image("leaf.jpg", leaf_jpeg(seed=2), "image/jpeg", max_edge=256, output_format=output_format)
+
+    assert (image.content_type, image.extension) == (content_type, extension)
+    assert Image.open(io.BytesIO(image.data)).format == pillow_format
+
+
+def test_normalize_rejects_unsupported_output_format():
+    with pytest.raises(ValueError):
+        normalize_image("leaf.jpg", leaf_jpeg(seed=3), "image/jpeg", max_edge=256, output_format="PNG")
+
+
+def test_undecodable_upload_is_rejected_before_upload(providers):
+    raw_files = [("leaf.heic", b"\x00\x00\x00\x18ftypheic" + b"\x00" * 64, "image/heic")]
+
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(main.run_analysis(**analysis_request(raw_files)))
+
+    assert rejected.value.status_code == 415
+    assert providers.uploads == []
+    assert providers.model_calls == 0
+    assert providers.saved == []
@@ -0,0 +1,70 @@
+"""
+Reference image cache: the disk directory stays bounded by the memory
+entries - evicted and replaced references lose their files, and warm()
+prunes whatever earlier runs left behind.
+"""
+
+import os
+
+from app.reference_index import ReferenceImageCache
+
+
+class FakeBlob:
+    def __init__(self, name: str):
+        self.name = name
+
+    def download_as_bytes(self) -> bytes:
+        return f"bytes of {self.name}".encode()
+
+
+class FakeStorageClient:
+    def bucket(self, name: str):
+        return self
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(name)
+
+
+def reference(name: str, generation: int = 1) -> dict:
+    return {"blob_name": f"refs/{name}.jpg", "generation": generation, "content_type": "image/jpeg"}
+
+
+def disk_files(cache: ReferenceImageCache) -> set:
+    return set(os.listdir(cache.cache_dir))
+
+
+def disk_name(cache: ReferenceImageCache, entry: dict) -> str:
+    return os.path.basename(cache._disk_path(cache.cache_key(entry)))
+
+
+def test_evicted_entries_leave_disk(tmp_path):
+    cache = ReferenceImageCache(FakeStorageClient(), "bucket", max_entries=2, cache_dir=str(tmp_path))
+    entries = [reference("scab"), reference("rot"), reference("rust")]
+
+    for entry in entries:
+        cache.fetch(entry)
+
+    assert disk_files(cache) == {disk_name(cache, e) for e in entries[1:]}
+
+
+def test_replaced_reference_drops_old_version(tmp_path):
+    cache = ReferenceImageCache(FakeStorageClient(), "bucket", max_entries=8, cache_dir=str(tmp_path))
+
+    cache.fetch(reference("scab", generation=1))
+    cache.fetch(reference("scab", generation=2))
+
+    assert cache.stats()["entries"] == 1
+    assert disk_files(cache) == {disk_name(cache, reference("scab", generation=2))}
+
+
+def test_warm_prunes_files_from_earlier_runs(tmp_path):
+    (tmp_path / ("0" * 64)).write_bytes(b"reference removed from the index")
+    old = ReferenceImageCache(FakeStorageClient(), "bucket", max_entries=8, cache_dir=str(tmp_path))
+    old.fetch(reference("scab", generation=1))
+
+    cache = ReferenceImageCache(FakeStorageClient(), "bucket", max_entries=8, cache_dir=str(tmp_path))
+    current = {"Apple Scab": reference("scab", generation=2), "Black Rot": reference("rot")}
+    assert cache.warm(current) == 2
+
+    assert disk_files(cache) == {disk_name(cache, e) for e in current.values()}
+    assert cache.stats()["disk_files"] == 2
@@ -0,0 +1,100 @@
+"""
+Regional weather prefetch against a local Open-Meteo stand-in: stale cells
+are refreshed, fresh ones skipped, and later lookups are served from cache.
+"""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import pytest
+
+from app.cache import TTLCache
+from conftest import main
+
+STALE_CELL = (18.5, 73.9)
+FRESH_CELL = (19.1, 72.9)
+
+
+class OpenMeteoStandIn(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        self.requests.append((float(query["latitude"][0]), float(query["longitude"][0])))
+        body = json.dumps({"daily": {"temperature_2m_max": [24.0, 26.0], "rain_sum": [20.0, 15.0]}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def open_meteo(monkeypatch):
+    OpenMeteoStandIn.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenMeteoStandIn)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(main, "OPEN_METEO_ARCHIVE_URL", f"http://127.0.0.1:{server.server_port}/v1/archive")
+    monkeypatch.setattr(main, "weather_cache", TTLCache("weather-test", max_entries=100, ttl_seconds=6 * 3600))
+    monkeypatch.setattr(main, "recent_consultation_cells", lambda since, limit: [STALE_CELL, FRESH_CELL])
+    monkeypatch.setattr(main, "http_client", main.http_client)
+    yield OpenMeteoStandIn.requests
+    server.shutdown()
+    server.server_close()
+
+
+async def with_http_client(coro_factory):
+    # The module-level client is bound to whichever loop used it first
+    async with httpx.AsyncClient() as client:
+        main.http_client = client
+        return await coro_factory()
+
+
+def seed_cache():
+    # Stale: expires before the next prefetch run. Fresh: outlives it.
+    main.weather_cache.set(main.weather_cache_key(*STALE_CELL), "old stale summary",
+                           ttl_seconds=main.WEATHER_PREFETCH_INTERVAL_SECONDS / 2)
+    main.weather_cache.set(main.weather_cache_key(*FRESH_CELL), "fresh summary",
+                           ttl_seconds=main.WEATHER_PREFETCH_INTERVAL_SECONDS * 2)
+
+
+def test_prefetch_refreshes_stale_cells_only(open_meteo):
+    seed_cache()
+
+    async def prefetch_then_lookup():
+        refreshed = await main.prefetch_regional_weather()
+        return refreshed, await main.get_weather(*STALE_CELL), await main.get_weather(*FRESH_CELL)
+
+    refreshed, stale_weather, fresh_weather = asyncio.run(with_http_client(prefetch_then_lookup))
+
+    assert refreshed == 1
+    assert open_meteo == [STALE_CELL]
+    assert stale_weather.startswith("Avg Temp: 25.0°C, Total Rain: 35.0mm")
+    assert fresh_weather == "fresh summary"
+
+
+def test_prefetch_loop_warms_the_cache(open_meteo):
+    seed_cache()
+
+    async def run_loop_once():
+        loop_task = asyncio.create_task(main.weather_prefetch_loop())
+        for _ in range(100):
+            if main.weather_cache.get(main.weather_cache_key(*STALE_CELL)) != "old stale summary":
+                break
+            await asyncio.sleep(0.02)
+        loop_task.cancel()
+        await asyncio.gather(loop_task, return_exceptions=True)
+        return await main.get_weather(*STALE_CELL)
+
+    stale_weather = asyncio.run(with_http_client(run_loop_once))
+
+    assert open_meteo == [STALE_CELL]
+    assert stale_weather.startswith("Avg Temp: 25.0°C")